@@ -32,7 +32,20 @@ async def run():
     UP_ARROW = 2490368
     DOWN_ARROW = 2621440
 
+    # Moves run in the background so frames keep being processed while the
+    # printer works. A new move is only issued from a frame grabbed after the
+    # previous one finished
+    move_task = None
+    move_done_at = 0.0
+
+    def _mark_move_done(_task):
+        nonlocal move_done_at
+        move_done_at = time.monotonic()
+
     while True:
+        # Give the Moonraker reader task a chance to run
+        await asyncio.sleep(0)
+        frame_time = time.monotonic()
         ret, frame = cap.read()
         if not ret:
             print("Failed to grab frame")
@@ -109,8 +122,9 @@ async def run():
 
             # print ("Multiplier", distMultipler)
 
-            await Eddie.send_command(command, distMultipler)
-            time.sleep(0.1)
+            if move_task is None or (move_task.done() and frame_time > move_done_at):
+                move_task = asyncio.ensure_future(Eddie.send_command(command, distMultipler))
+                move_task.add_done_callback(_mark_move_done)
 
             if command_text == "No tag detected":
                 command_text = f"Cmd: {command}"
@@ -129,8 +143,11 @@ async def run():
         elif key == DOWN_ARROW:
             target_scale = max(target_scale * (1 - scale_step_fraction), min_scale)
 
+    if move_task is not None:
+        await move_task
     cap.release()
     cv2.destroyAllWindows()
+    await Eddie.disconnect()
 
 if __name__ == "__main__":
     asyncio.run(run())
@@ -3,13 +3,14 @@ import cv2
 import time
 import math
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Dict, Tuple
 from pathlib import Path
 import re
 
-from commandAssembler import CommandAssembler
+from commandAssembler import CommandAssembler, expected_target
 from enderTalker import CameraController
 from pupil_apriltags import Detector
+from waypointStore import WaypointStore
 
 
 @dataclass
@@ -61,6 +62,8 @@ class AutoCalibrator:
         self.goalTag = goalTag
         base = Path(__file__).resolve().parent
         self.filepath = base / "assets" / filename
+        # waypoints.txt is imported into the store the first time it is opened
+        self.waypoints = WaypointStore(self.filepath.with_suffix(".db"), legacy_path=self.filepath)
 
         # Key codes from cv2.waitKeyEx for arrow input
         self.UP_ARROW = 2490368
@@ -79,6 +82,7 @@ class AutoCalibrator:
         self.yLoc = 0
         self.xLoc = 0
         self.latestDist = 1
+        self._absolute = True
 
     def run(self) -> None:
         if self._loop.is_closed():
@@ -135,23 +139,25 @@ class AutoCalibrator:
         if self.printer.running:
             return True
         try:
-            return bool(self._run_async(self.printer.connect()))
+            if not self._run_async(self.printer.connect()):
+                return False
         except Exception as exc:
             print(f"Printer connection failed: {exc}")
             return False
+        # Without the subscription _send_gcode falls back to M400
+        self._run_async(self.printer.subscribe_toolhead())
+        return True
 
     def _initialize_printer_position(self) -> None:
         #self._send_gcode(self.command_assembler.home(), wait_completion=True)
         self._send_gcode(self.command_assembler.set_absolute())
-        saved = self.read_markers()
-        for line in saved:
-            name, x, y = line.split(',')
-            print(line)
-            if int(name) == self.goalTag:
-                self.xLoc = int(float(x))
-                self.yLoc = int(float(y))
-                self.xIncLoc = int(float(x))
-                self.yIncLoc = int(float(y))
+        waypoint = self.waypoints.get(self.goalTag)
+        if waypoint is not None:
+            print(f"{self.goalTag},{waypoint.x},{waypoint.y}")
+            self.xLoc = int(waypoint.x)
+            self.yLoc = int(waypoint.y)
+            self.xIncLoc = int(waypoint.x)
+            self.yIncLoc = int(waypoint.y)
         print(self.xLoc)
         print(self.yLoc)
         self._send_gcode(self.command_assembler.set_x(self.xLoc), wait_completion=True)
@@ -163,12 +169,28 @@ class AutoCalibrator:
     def _send_gcode(self, gcode: str, wait_completion: bool = False) -> None:
         if not gcode:
             return
-        script = f"{gcode}\nM400" if wait_completion else gcode
+        target = self._expected_target(gcode)
+        # With the toolhead subscription we wait for the live status to reach the
+        # target instead of holding Klipper's G-code queue with M400
+        tracking = self.printer.toolhead is not None
+        script = f"{gcode}\nM400" if wait_completion and not tracking else gcode
         try:
             self._run_async(self.printer.send_gcode(script))
+            if wait_completion and tracking:
+                self._run_async(self.printer.wait_idle(target))
         except Exception as exc:
             print(f"Failed to send G-code '{gcode}': {exc}")
 
+    def _expected_target(self, gcode: str) -> Dict[str, float]:
+        # Work out where the commanded position ends up once gcode has run
+        snapshot = self.printer.toolhead
+        target, self._absolute = expected_target(
+            gcode,
+            self._absolute,
+            position=None if snapshot is None else snapshot.gcode_position,
+        )
+        return target
+
     def _cleanup_printer(self) -> None:
         if self._loop.is_closed():
             return
@@ -236,28 +258,8 @@ class AutoCalibrator:
 
         return command_label
 
-    def read_markers(self):
-        markers = []
-        with open(self.filepath, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue  # skip empty lines
-                markers.append(line)
-        return markers
-
-
     def update_line(self, marker_name, new_x, new_y):
-        with open(self.filepath, 'r') as f:
-            lines = f.readlines()
-
-        with open(self.filepath, 'w') as f:
-            for line in lines:
-                if line.startswith(str(self.goalTag) + ','):
-                    # Replace this line with the new data
-                    f.write(f"{str(self.goalTag)},{str(new_x)},{str(new_y)}\n")
-                else:
-                    f.write(line)      
+        self.waypoints.record(self.goalTag, new_x, new_y, self.zHeight)
 
 
     def _determine_command(self, tag_center_x: float, tag_center_y: float, region: TargetRegion) -> str:
@@ -460,6 +462,8 @@ class AutoCalibrator:
         self.consecutive_center = 0
         if(self.zHeight <= (self.zChange - 1)):
             self.calibration_complete = True
+            if self.printer.toolhead is not None:
+                self.xLoc, self.yLoc = self.printer.toolhead.gcode_position[:2]
             self.update_line(self.tag_id, self.xLoc, self.yLoc)
 
 
@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Union
+
+import cv2
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    cell_x INTEGER NOT NULL,
+    cell_y INTEGER NOT NULL,
+    cell_z INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    z REAL NOT NULL,
+    image BLOB NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (cell_x, cell_y, cell_z)
+);
+"""
+
+
+@dataclass
+class Tile:
+    x: float
+    y: float
+    z: float
+    image: np.ndarray
+    created: float
+
+
+class BedMosaic:
+    """Search frames kept at the toolhead XY they were taken from.
+
+    The raster search sees most of the bed, so its frames are stored as
+    downscaled grayscale tiles (one per ``cell_mm`` grid cell and Z) in the
+    waypoint database. Tiles older than ``max_age`` seconds are ignored and
+    pruned, the bed may have been rearranged since.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_age: float = 3600.0,
+        cell_mm: float = 10.0,
+        scale: float = 0.5,
+    ) -> None:
+        self.path = Path(path)
+        self.max_age = max_age
+        self.cell_mm = cell_mm
+        self.scale = scale
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def add(self, gray: np.ndarray, x: float, y: float, z: float) -> None:
+        if self.scale != 1:
+            gray = cv2.resize(
+                gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA
+            )
+        ok, encoded = cv2.imencode(".jpg", gray, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        if not ok:
+            print("Unable to encode mosaic tile")
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tiles"
+                " (cell_x, cell_y, cell_z, x, y, z, image, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    round(x / self.cell_mm),
+                    round(y / self.cell_mm),
+                    round(z),
+                    x,
+                    y,
+                    z,
+                    encoded.tobytes(),
+                    now,
+                ),
+            )
+            self._conn.execute(
+                "DELETE FROM tiles WHERE created < ?", (now - self.max_age,)
+            )
+
+    def tiles(self) -> List[Tile]:
+        """Fresh tiles, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT x, y, z, image, created FROM tiles WHERE created >= ?"
+                " ORDER BY created DESC",
+                (time.time() - self.max_age,),
+            ).fetchall()
+        return [
+            Tile(
+                x,
+                y,
+                z,
+                cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_GRAYSCALE),
+                created,
+            )
+            for x, y, z, image, created in rows
+        ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM tiles")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    print("This module is intended to be imported, not run directly.")
@@ -0,0 +1,1257 @@
+import cv2
+import json
+import sys
+import time
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from pathlib import Path
+import requests
+import numpy as np
+
+from bedMosaic import BedMosaic
+from commandAssembler import (
+    MOTION_PROFILES,
+    CommandAssembler,
+    MotionLimits,
+    MotionProfile,
+)
+from detectionService import DETECTION_DTYPE, to_array
+from printerLink import (
+    DatagramLink,
+    MoonrakerLink,
+    PrinterLink,
+    RemoteMethodLink,
+    SocketLink,
+)
+from pupil_apriltags import Detector
+from patchCache import PatchCache, center_patch, relocalise
+from waypointStore import WaypointStore
+
+
+@dataclass
+class TargetRegion:
+    top: int
+    bottom: int
+    left: int
+    right: int
+    center_x: int
+    center_y: int
+
+
+def load_profile(path: Union[str, Path]) -> Dict[str, float]:
+    """AutoCalibrator keyword arguments from a tuned profile (see gainSweep.py)."""
+    with open(path, "r") as f:
+        return json.load(f)["params"]
+
+
+def descent_heights(
+    z: float, change: float, final: Optional[float] = None
+) -> List[float]:
+    """Heights the stage recurrence visits below ``z``, the last one final.
+
+    With ``final`` set, the descent stops there instead of wherever the
+    recurrence would end.
+    """
+    heights = []
+    while True:
+        z -= change
+        change = (z + 70) / 10
+        if final is not None and z <= final:
+            heights.append(final)
+            return heights
+        heights.append(z)
+        if z <= change - 1:
+            return heights
+
+
+class AutoCalibrator:
+    def __init__(
+        self,
+        camera_index: int = 0,
+        target_scale: float = 1,
+        scale_step_fraction: float = 0.05,
+        min_scale: float = 0.05,
+        max_scale: float = 0.9,
+        dist_weight: float = 0.8,
+        size_weight: float = 0.2,
+        near_px: float = 50,
+        far_px: float = 250,
+        size_ref_px: float = 200,
+        zHeightStart: int = 115,
+        maxLatandLonMove: int = 220,
+        incramentalMove: int = 30,
+        initalXandYLoc: int = 15,  # This is where the gantry will start on the bed
+        filename: str = "waypoints.json",
+        goalTag: int = 3,
+        warm_start: bool = True,
+        warm_start_max_age: float = 24 * 3600,
+        warm_start_max_spread: float = 2.0,
+        warm_start_min_z: float = 30,
+        warm_start_radius: float = 30,
+        warm_start_search_moves: int = 6,
+        verify_z: float = 40,
+        verify_frames: int = 3,
+        verify_threshold_mm: float = 0.5,
+        tag_size_mm: float = 20.0,  # printed side length of the black square
+        patch_size: int = 192,
+        min_estimate_weight: float = 1.0,
+        min_decision_margin: float = 20.0,
+        max_hamming: int = 1,
+        mosaic_max_age: float = 3600.0,
+        motion_profiles: Optional[Dict[str, MotionProfile]] = None,
+        restore_accel: Optional[float] = None,
+        motion_limits: Optional[MotionLimits] = None,
+        settle_fraction: float = 0.1,
+        min_settle: float = 0.03,
+        max_settle: float = 0.3,
+        prefetch_frames: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        max_descent_correction_mm: float = 5.0,
+        adaptive_stages: bool = True,
+        lens_z_offset: float = 70.0,
+        max_tag_fraction: float = 0.5,
+        max_final_skip_ratio: float = 1.2,
+        link: Optional[PrinterLink] = None,
+        snapshot_url: str = "http://localhost/webcam/?action=snapshot",
+        detect: Optional[Callable] = None,
+        show_window: bool = False,
+        publisher=None,
+    ) -> None:
+        self.camera_index = camera_index
+        self.target_scale = target_scale
+        # Stages and warm starts shrink target_scale, each session starts here
+        self.initial_target_scale = target_scale
+        self.scale_step_fraction = scale_step_fraction
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.dist_weight = dist_weight
+        self.size_weight = size_weight
+        # Step size breakpoints, see _compute_distance_multiplier: offsets
+        # under near_px creep, past far_px the step stops growing, and tags
+        # are compared to a size_ref_px diagonal
+        self.near_px = near_px
+        self.far_px = far_px
+        self.size_ref_px = size_ref_px
+        # Detection can be handed to a shared pool when several printers run
+        # on one host, see calibratorDaemon.py
+        self.detector = Detector(families="tag36h11") if detect is None else None
+        self.detect = detect if detect is not None else self.detector.detect
+        # Weak or error-corrected decodes are dropped before any decision
+        self.min_decision_margin = min_decision_margin
+        self.max_hamming = max_hamming
+        self.snapshot_url = snapshot_url
+        # Optional DetectionPublisher that shares each detection pass
+        self.publisher = publisher
+        self.frame_id = 0
+        self.show_window = show_window
+        self.command_assembler = CommandAssembler(limits=motion_limits)
+        # Frames are timed off the assembler's move estimates: the next frame
+        # is fetched so it is taken just after the move ends plus a settle
+        # window proportional to the move, see _send_batch
+        self.settle_fraction = settle_fraction
+        self.min_settle = min_settle
+        self.max_settle = max_settle
+        # Without prefetching the settle window is simply waited out after
+        # the move. Benchmarks pass a simulated clock and sleep with it so a
+        # session runs single threaded and faster than real time.
+        self.prefetch_frames = prefetch_frames
+        self.clock = clock
+        self.sleep = sleep
+        # How late wait_idle notices the end of a move (the extension's idle
+        # margin and tick), used to spot moves that outran their estimate
+        self.idle_lag = 0.1
+        self.frame_latency = 0.1  # running average of a snapshot fetch
+        self._prefetcher = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="frame-prefetch"
+        )
+        self._prefetch: Optional[Future] = None
+        # Feedrate (and optional ACCEL) per phase: "travel" for search hops and
+        # moves to a known position, "approach" for centring, "descent" for Z.
+        # The G-code state (feedrate, G90/G91) is saved for the session and
+        # restored at the end. If a profile changes ACCEL, restore_accel is set
+        # again too.
+        self.motion_profiles = {**MOTION_PROFILES, **(motion_profiles or {})}
+        self.restore_accel = restore_accel
+        # self.printer = CameraController() - removing old enderTalker
+        self.cap = None
+        self.zHeightStart = zHeightStart
+        self.initalXandYLoc = initalXandYLoc
+        self.maxLatandLonMove = (
+            maxLatandLonMove  # most the gantry cna move in the x and y directions
+        )
+        self.incramentalMove = (
+            incramentalMove  # how much the gantry can move each time.
+        )
+        self.xMoveDirectionPositive = True
+        self.yMoveDirectionPositive = True
+        # A recently confirmed, repeatable waypoint lets a session start low
+        # with a small search area, see _plan_warm_start
+        self.use_warm_start = warm_start
+        self.warm_start_max_age = warm_start_max_age
+        self.warm_start_max_spread = warm_start_max_spread
+        self.warm_start_min_z = warm_start_min_z
+        self.warm_start_radius = warm_start_radius
+        self.warm_start_search_moves = warm_start_search_moves
+        # APRILTAGS_VERIFY checks the waypoint at one height, see verify
+        self.verify_z = verify_z
+        self.verify_frames = verify_frames
+        self.verify_threshold_mm = verify_threshold_mm
+        self.tag_size_mm = tag_size_mm
+        self.patch_size = patch_size
+        # Other tags seen on the way are kept as coarse estimates, and a tag
+        # with no waypoint starts from its estimate once it is trusted enough
+        self.min_estimate_weight = min_estimate_weight
+        # Each descent also moves XY by the goal tag's remaining offset, up to
+        # this far, see _ensure_stage_announced
+        self.max_descent_correction_mm = max_descent_correction_mm
+        # Pick each stage's Z from the centring residual and the tag's size
+        # instead of stepping through every height, see _plan_next_z.
+        # Apparent size goes as 1 / (Z + lens_z_offset), and the tag may fill
+        # at most max_tag_fraction of the short side of the frame. The final
+        # height is only skipped to from where mm/px is within
+        # max_final_skip_ratio of its own, a residual measured higher up is
+        # too coarse to land on.
+        self.adaptive_stages = adaptive_stages
+        self.lens_z_offset = lens_z_offset
+        self.max_tag_fraction = max_tag_fraction
+        self.max_final_skip_ratio = max_final_skip_ratio
+        self.final_z = descent_heights(zHeightStart, zHeightStart / 10)[-1]
+        self.filename = filename
+        self.tag_id = 0
+        self.goalTag = goalTag
+        base = Path(__file__).resolve().parent
+        # An absolute filename replaces the assets directory
+        self.filepath = base / "assets" / filename
+        # Waypoints live in SQLite next to the old file, which is imported once
+        self.waypoints = WaypointStore(
+            self.filepath.with_suffix(".db"), legacy_path=self.filepath
+        )
+        # View over each waypoint at the final Z, used by verify to re-localise
+        # without a full AprilTag pass
+        self.patches = PatchCache(self.waypoints.path)
+        # Frames from the raster search, looked through before sweeping again
+        self.mosaic = BedMosaic(self.waypoints.path, max_age=mosaic_max_age)
+
+        # Key codes from cv2.waitKeyEx for arrow input
+        self.UP_ARROW = 2490368
+        self.DOWN_ARROW = 2621440
+
+        self._reset_session()
+        # Transport to the printer, see printerLink.py
+        self.link = link if link is not None else SocketLink()
+
+    def run_session(self, tag_id: int, mode: str = "calibrate") -> None:
+        self.goalTag = tag_id
+        # Restored in _restore_printer_state before the session finishes
+        self._send_gcode(self.command_assembler.save_state())
+        if mode == "verify":
+            self.verify()
+        else:
+            self.run()
+
+    def verify(self) -> None:
+        """Check the goal tag's waypoint without a descent.
+
+        The gantry goes straight to the waypoint at ``verify_z`` and measures
+        how far the tag sits from the image centre over a few frames. Only a
+        residual above ``verify_threshold_mm`` (or a missing tag) falls back to
+        a full calibration.
+        """
+        self.started = self.clock()
+        recalibrate = False
+        try:
+            recalibrate = self._check_waypoint()
+        finally:
+            # Like run(), the printer gets its state back and DONE even when
+            # a frame grab raises
+            if not recalibrate:
+                self._cleanup_printer()
+        if recalibrate:
+            self.run()
+
+    def _check_waypoint(self) -> bool:
+        """Measure and report the residual, True when a calibration is needed."""
+        residual = self._spot_check() or self._measure_residual()
+        if residual is None:
+            self._respond(f"Tag {self.goalTag} not verified, recalibrating")
+            return True
+        offset_px, offset_mm, z = residual
+        error_mm = math.hypot(*offset_mm)
+        summary = (
+            f"Tag {self.goalTag} residual {math.hypot(*offset_px):.1f} px,"
+            f" {error_mm:.2f} mm (dx {offset_mm[0]:.2f}, dy {offset_mm[1]:.2f})"
+        )
+        print(summary)
+        # The measured tag position goes into the history without replacing the
+        # waypoint, so drift shows up in the warm start confidence
+        self.waypoints.record(
+            self.goalTag,
+            self.xLoc + offset_mm[0],
+            self.yLoc + offset_mm[1],
+            z,
+            iterations=self.frames,
+            duration=self.clock() - self.started,
+            kind="verify",
+            update=False,
+        )
+        if error_mm > self.verify_threshold_mm:
+            self._respond(f"{summary}, recalibrating")
+            self._reset_session()
+            return True
+        self._respond(summary)
+        return False
+
+    def _measure_residual(self):
+        """Median tag offset from the image centre in px and world mm."""
+        waypoint = self.waypoints.get(self.goalTag)
+        if waypoint is None:
+            return None
+        self.xLoc, self.yLoc = waypoint.x, waypoint.y
+        self._move_to(self.xLoc, self.yLoc, self.verify_z)
+        self._sync_position()
+        offsets = []
+        scales = []
+        for _ in range(self.verify_frames):
+            ret, frame = self._next_frame()
+            if not ret:
+                print("Failed to grab frame")
+                continue
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            goal = self._goal_detection(self._detect_frame(gray))
+            if goal is None:
+                continue
+            height, width = gray.shape
+            offsets.append(goal["center"] - (width / 2, height / 2))
+            scales.append(self._mm_per_px(goal["corners"]))
+        if not offsets:
+            return None
+        offset_px = np.median(offsets, axis=0)
+        offset_mm = self._pixels_to_mm(offset_px, np.median(scales))
+        return offset_px, offset_mm, self.verify_z
+
+    def _spot_check(self):
+        """Re-localise against the cached patch, same result as _measure_residual."""
+        patch = self.patches.get(self.goalTag)
+        if patch is None:
+            return None
+        self.xLoc, self.yLoc = patch.x, patch.y
+        self._move_to(self.xLoc, self.yLoc, patch.z)
+        self._sync_position()
+        ret, frame = self._next_frame()
+        if not ret:
+            print("Failed to grab frame")
+            return None
+        self.frames += 1
+        found = relocalise(patch.image, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        if found is None:
+            print(f"Patch for tag {self.goalTag} not found, checking the tag")
+            return None
+        offset_px = np.array(found[:2])
+        return offset_px, self._pixels_to_mm(offset_px, patch.mm_per_px), patch.z
+
+    def _capture_patch(self) -> None:
+        # Runs at the final Z, once the goal tag is centred
+        ret, frame = self._next_frame()
+        if not ret:
+            return
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        goal = self._goal_detection(self._detect_frame(gray))
+        if goal is None:
+            # A patch from an older waypoint would re-localise to the wrong place
+            self.patches.discard(self.goalTag)
+            return
+        self.patches.put(
+            self.goalTag,
+            center_patch(gray, self.patch_size).copy(),
+            self.xLoc,
+            self.yLoc,
+            self.zHeight,
+            self._mm_per_px(goal["corners"]),
+        )
+
+    def _respond(self, message: str) -> None:
+        # Shown in the printer's console, each link has its own way there
+        self.link.respond(message)
+
+    def run(self) -> None:
+        # if not self._ensure_printer_connected():
+        #     self._cleanup_printer()
+        #     return
+
+        if self.use_warm_start:
+            self._plan_warm_start()
+        self._initialize_printer_position()
+        self.started = self.clock()
+
+        # self.cap = self._open_camera()
+        try:
+            while True:
+                self._ensure_stage_announced()
+                if self.calibration_complete:
+                    break
+
+                ret, frame = self._next_frame()
+                if not ret:
+                    print("Failed to grab frame")
+                    break
+
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                detections = self._detect_frame(gray)
+
+                region = self._calculate_target_region(frame.shape[:2])
+                # self._draw_target_region(frame, region)
+
+                self._sync_position()
+                self._harvest(detections, gray.shape)
+
+                command_label = self._process_detections(frame, detections, region)
+                if command_label == "No tag detected":
+                    if not self._search_mosaic():
+                        self.mosaic.add(gray, self.xLoc, self.yLoc, self.zHeight)
+                        self._change_x_span()
+
+                if self.calibration_complete:
+                    continue
+
+                # self._draw_overlay(frame, command_label)
+
+                # cv2.imshow("AprilTag detections", frame)
+
+                if self.show_window and not self._handle_key(cv2.waitKeyEx(1)):
+                    break
+        finally:
+            if self.cap is not None:
+                self.cap.release()
+            # cv2.destroyAllWindows()
+            self._cleanup_printer()
+
+    def _initialize_printer_position(self) -> None:
+        # self._send_gcode(self.command_assembler.home(), wait_completion=True)
+        waypoint = self.waypoints.get(self.goalTag)
+        if waypoint is not None:
+            print(f"{self.goalTag}: x={waypoint.x}, y={waypoint.y}")
+            self.xLoc = int(waypoint.x)
+            self.yLoc = int(waypoint.y)
+            self.xIncLoc = int(waypoint.x)
+            self.yIncLoc = int(waypoint.y)
+        else:
+            self._start_from_estimate()
+        print(self.xLoc)
+        print(self.yLoc)
+        self._move_to(self.xLoc, self.yLoc)
+        # REMOVED: self._send_gcode(self.command_assembler.set_relative())
+
+    def _send_gcode(self, gcode: str, wait_completion: bool = False):
+        if not gcode:
+            return
+        self._send_batch([gcode], wait_completion)
+
+    def _send_batch(self, batch: List[str], wait_completion: bool = False) -> None:
+        # One script per batch, so one round trip to the printer
+        if not batch:
+            return
+        duration = self.command_assembler.last_duration
+        sent_at = self.clock()
+        self.link.send(batch)
+        if not wait_completion:
+            return
+        if not duration:
+            self.link.wait_idle()
+            return
+        settle = min(
+            max(self.settle_fraction * duration, self.min_settle), self.max_settle
+        )
+        if not self.prefetch_frames:
+            self.link.wait_idle()
+            self.sleep(settle)
+            return
+        # Start the fetch early by half its latency so the camera grabs the
+        # frame right as the settle window ends
+        capture_at = sent_at + duration + settle - self.frame_latency / 2
+        self._discard_prefetch()
+        self._prefetch = self._prefetcher.submit(self._fetch_at, capture_at)
+        self.link.wait_idle()
+        if self.clock() - self.idle_lag > capture_at:
+            # The move ran longer than estimated, that frame may be blurred
+            self._discard_prefetch()
+
+    def _fetch_at(self, capture_at: float):
+        delay = capture_at - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+        return self._fetch_frame()
+
+    def _fetch_frame(self):
+        started = self.clock()
+        result = self._get_frame(self.snapshot_url)
+        self.frame_latency = 0.8 * self.frame_latency + 0.2 * (self.clock() - started)
+        return result
+
+    def _next_frame(self):
+        """The frame prefetched after the last move, or a fresh one."""
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch is not None:
+            try:
+                ret, frame = prefetch.result()
+                if ret:
+                    return ret, frame
+            except Exception as exc:
+                print(f"Frame prefetch failed: {exc}")
+        return self._fetch_frame()
+
+    def _discard_prefetch(self) -> None:
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch is not None:
+            prefetch.cancel()
+
+    def _move_to(self, x: float, y: float, z: Optional[float] = None) -> None:
+        """Absolute XY and Z moves, sent together and waited on.
+
+        Z stays its own move so the camera never cuts diagonally over the bed.
+        A descent runs after the XY travel and a climb before it, so the
+        travel always happens at the higher of the two heights.
+        """
+        assembler = self.command_assembler
+        current_z = assembler.position["Z"]
+        if current_z is None:
+            position = self.link.position()
+            if position is not None:
+                assembler.set_position(position)
+                current_z = position[2]
+        climb = z is not None and current_z is not None and z > current_z
+
+        def move(profile: str, *targets) -> Tuple[List[str], Optional[float]]:
+            assembler.begin()
+            assembler.set_absolute()
+            assembler.use_profile(self.motion_profiles[profile])
+            for set_axis, value in targets:
+                set_axis(value)
+            return assembler.flush(), assembler.last_duration
+
+        def travel():
+            return move("travel", (assembler.set_x, x), (assembler.set_y, y))
+
+        def change_z():
+            return move("descent", (assembler.zoom_in, z))
+
+        # Built in the order they run, the assembler follows the modal state
+        if z is None:
+            steps = [travel]
+        else:
+            steps = [change_z, travel] if climb else [travel, change_z]
+        moves = [step() for step in steps]
+        batch = [line for lines, _ in moves for line in lines]
+        durations = [duration for _, duration in moves]
+        assembler.last_duration = None if None in durations else sum(durations)
+        self._send_batch(batch, wait_completion=True)
+
+    def _start_from_estimate(self) -> None:
+        estimate = self.waypoints.estimate(self.goalTag)
+        if estimate is None or estimate.weight < self.min_estimate_weight:
+            return
+        print(f"{self.goalTag}: estimated x={estimate.x:.1f}, y={estimate.y:.1f}")
+        self.xLoc = self.xIncLoc = int(estimate.x)
+        self.yLoc = self.yIncLoc = int(estimate.y)
+        # Estimates are coarse, keep the search around them but wider than
+        # around a waypoint
+        radius = 2 * self.warm_start_radius
+        self.search_x_min = max(0, estimate.x - radius)
+        self.search_x_max = min(self.maxLatandLonMove, estimate.x + radius)
+        self.search_y_min = max(0, estimate.y - radius)
+        self.search_y_max = min(self.maxLatandLonMove, estimate.y + radius)
+        self.search_bounded = True
+
+    def _detect_frame(self, gray) -> np.ndarray:
+        """Detect, publish and quality-filter one frame as a DETECTION_DTYPE array."""
+        detections = self.detect(gray)
+        if not isinstance(detections, np.ndarray) or detections.dtype != DETECTION_DTYPE:
+            detections = to_array(detections)
+        self.frame_id += 1
+        self.frames += 1
+        if self.publisher is not None:
+            self.publisher.publish(self.frame_id, detections)
+        return self._filter_detections(detections)
+
+    def _filter_detections(self, detections) -> np.ndarray:
+        if not isinstance(detections, np.ndarray) or detections.dtype != DETECTION_DTYPE:
+            detections = to_array(detections)
+        keep = (detections["decision_margin"] >= self.min_decision_margin) & (
+            detections["hamming"] <= self.max_hamming
+        )
+        return detections[keep]
+
+    def _goal_detection(self, detections: np.ndarray, tag_id: Optional[int] = None):
+        """The goal (or ``tag_id``) tag's best decode in the frame, or None."""
+        tag_id = self.goalTag if tag_id is None else tag_id
+        goal = detections[detections["tag_id"] == tag_id]
+        if len(goal) == 0:
+            return None
+        return goal[np.argmax(goal["decision_margin"])]
+
+    def find_in_mosaic(self, tag_id: int) -> Optional[Tuple[float, float]]:
+        """Bed XY of ``tag_id`` from the cached search tiles, or None."""
+        for tile in self.mosaic.tiles():
+            found = self._goal_detection(
+                self._filter_detections(self.detect(tile.image)), tag_id
+            )
+            if found is None:
+                continue
+            height, width = tile.image.shape
+            dx, dy = self._pixels_to_mm(
+                found["center"] - (width / 2, height / 2),
+                self._mm_per_px(found["corners"]),
+            )
+            return tile.x + float(dx), tile.y + float(dy)
+        return None
+
+    def _search_mosaic(self) -> bool:
+        # Only the first miss of a session looks at the tiles, after that the
+        # sweep is adding them
+        if self.mosaic_searched:
+            return False
+        self.mosaic_searched = True
+        found = self.find_in_mosaic(self.goalTag)
+        if found is None:
+            return False
+        print(
+            f"Tag {self.goalTag} found in the bed mosaic"
+            f" at {found[0]:.1f}, {found[1]:.1f}"
+        )
+        self.xLoc = self.xIncLoc = found[0]
+        self.yLoc = self.yIncLoc = found[1]
+        self._move_to(self.xLoc, self.yLoc)
+        return True
+
+    def _harvest(self, detections: np.ndarray, frame_shape: Tuple[int, int]) -> None:
+        """Turn sightings of other tags into coarse position estimates."""
+        others = detections[detections["tag_id"] != self.goalTag]
+        if len(others) == 0:
+            return
+        height, width = frame_shape
+        half_diagonal = math.hypot(width, height) / 2
+        offset = others["center"] - (width / 2, height / 2)
+        offset_mm = self._pixels_to_mm(offset, self._mm_per_px(others["corners"]))
+        xs = self.xLoc + offset_mm[:, 0]
+        ys = self.yLoc + offset_mm[:, 1]
+        # Clean decodes near the optical centre are trusted most
+        weights = np.minimum(1.0, others["decision_margin"] / 100) * (
+            1 - 0.5 * np.hypot(offset[:, 0], offset[:, 1]) / half_diagonal
+        )
+        self.waypoints.add_sightings(
+            (int(tag_id), float(x), float(y), float(weight))
+            for tag_id, x, y, weight in zip(others["tag_id"], xs, ys, weights)
+            if weight > 0
+        )
+
+    def _mm_per_px(self, corners):
+        """Scale from the apparent side length, for one (4, 2) or many (n, 4, 2) tags."""
+        corners = np.asarray(corners, dtype=float)
+        edges = corners - np.roll(corners, 1, axis=-2)
+        return self.tag_size_mm / np.linalg.norm(edges, axis=-1).mean(axis=-1)
+
+    def _pixels_to_mm(self, offset_px, mm_per_px) -> np.ndarray:
+        """Image offsets from the centre to bed mm, for one (2,) or many (n, 2).
+
+        Image right is +X and image up is +Y, matching _determine_command.
+        """
+        offset_px = np.asarray(offset_px, dtype=float)
+        mm_per_px = np.asarray(mm_per_px, dtype=float)[..., None]
+        return offset_px * mm_per_px * (1.0, -1.0)
+
+    def _sync_position(self) -> None:
+        # The printer reports the toolhead's commanded position, use it instead
+        # of the dead-reckoned location whenever the link has a fresh one
+        position = self.link.position()
+        if position is None:
+            return
+        self.xLoc, self.yLoc = position[0], position[1]
+        self.command_assembler.set_position(position)
+
+    def _cleanup_printer(self) -> None:
+        self.link.wait_idle()
+        self._sync_position()
+        if self.calibration_complete:
+            self._capture_patch()
+        self._restore_printer_state()
+        self.link.finish()
+        # Only a finished calibration replaces the waypoint
+        if self.calibration_complete:
+            self._save_waypoint()
+        self._reset_session()
+
+    def _restore_printer_state(self) -> None:
+        # The motion profiles' feedrates and G90/G91 come back with the G-code
+        # state saved in run_session. SET_VELOCITY_LIMIT is not part of that
+        # state and outlives the session, so ACCEL is put back for prints here.
+        batch = [self.command_assembler.restore_state()]
+        if self.command_assembler.accel_changed:
+            if self.restore_accel is None:
+                print("Motion profile changed ACCEL but no restore_accel is set")
+            else:
+                batch.append(self.command_assembler.set_accel(self.restore_accel))
+        self._send_batch([line for line in batch if line])
+
+    def _reset_session(self) -> None:
+        # Calibration staging, everything here belongs to a single run.
+        # Between runs anything may have changed the printer's G90/G91 state.
+        self.command_assembler.invalidate()
+        if hasattr(self, "_prefetch"):
+            self._discard_prefetch()
+        self.calibration_complete = False
+        self.xIncLoc = self.initalXandYLoc
+        self.yIncLoc = self.initalXandYLoc
+        self.yLoc = 0
+        self.xLoc = 0
+        self.latestDist = 1
+        # Frames and wall time, kept with the result in the waypoint history
+        self.frames = 0
+        self.started = None
+        self.search_moves = 0
+        self.mosaic_searched = False
+        self._reset_descent()
+
+    def _reset_descent(self) -> None:
+        # A cold start from the top: the whole bed to search and every stage
+        # still ahead. The position and session counters are left alone.
+        self.calibration_stages = ["S1", "S2", "S3", "calibrated"]
+        self.stage_index = 0
+        self.consecutive_center = 0
+        self.stage_announced = False
+        self.zHeight = self.zHeightStart
+        self.zChange = (
+            self.zHeightStart / 10
+        )  # THIS VALUE IS WHAT THE CONSTANGE CHANGE IS - IF TOO SLOW INCREASE IT
+        self.target_scale = self.initial_target_scale
+        self.warm_start = False
+        self.centered_frames_required = 5
+        self.search_x_min = self.search_y_min = 0
+        self.search_x_max = self.search_y_max = self.maxLatandLonMove
+        self.search_step = self.incramentalMove
+        # Set when the search is limited to an area around a prior position
+        self.search_bounded = False
+        # Goal tag offset from the camera centre in the last frame it was seen
+        self.goal_offset_mm = None
+        self.goal_mm_per_px = None
+        self.frame_short_side = None
+        # Halfway stages added by _plan_next_z, capped so the descent ends
+        self.extra_stages = 0
+        # Set once the final height is reached, a centred frame there finishes
+        self.final_stage = False
+
+    def _open_camera(self) -> cv2.VideoCapture:
+        cap = cv2.VideoCapture(self.camera_index, cv2.CAP_DSHOW)
+        if not cap.isOpened():
+            raise RuntimeError(f"Unable to open camera index {self.camera_index}")
+        return cap
+
+    def _calculate_target_region(self, frame_shape: Tuple[int, int]) -> TargetRegion:
+        frame_height, frame_width = frame_shape
+        target_side = max(
+            1, int(min(frame_width, frame_height) * (self.target_scale / 10))
+        )
+        half_side = target_side // 2
+        center_x = frame_width // 2
+        center_y = frame_height // 2
+        top = max(0, center_y - half_side)
+        bottom = min(frame_height, center_y + half_side)
+        left = max(0, center_x - half_side)
+        right = min(frame_width, center_x + half_side)
+        return TargetRegion(
+            top=top,
+            bottom=bottom,
+            left=left,
+            right=right,
+            center_x=center_x,
+            center_y=center_y,
+        )
+
+    def _draw_target_region(self, frame, region: TargetRegion) -> None:
+        cv2.rectangle(
+            frame,
+            (region.left, region.top),
+            (region.right, region.bottom),
+            (0, 0, 255),
+            2,
+        )
+
+    def _process_detections(
+        self, frame, detections: np.ndarray, region: TargetRegion
+    ) -> str:
+        # One decision per frame, from the goal tag only. Other tags never
+        # move the gantry, _harvest keeps them as estimates.
+        goal = self._goal_detection(detections)
+        if goal is None:
+            return "No tag detected"
+        pts = goal["corners"].astype(int)
+        tag_center_x, tag_center_y = (float(value) for value in goal["center"])
+        print(self.goalTag)
+
+        # cv2.polylines(frame, [pts], True, (0, 255, 0), 2)
+        center_point = (int(tag_center_x), int(tag_center_y))
+        # cv2.circle(frame, center_point, 4, (0, 255, 255), -1)
+
+        self._track_goal(goal, region)
+        multiplier = self._compute_distance_multiplier(pts, center_point, region)
+        command = self._determine_command(tag_center_x, tag_center_y, region)
+
+        self._emit_command(command, multiplier)
+        self._handle_command_for_stage(command)
+        return f"Cmd: {command}"
+
+    def _track_goal(self, goal, region: TargetRegion) -> None:
+        # Where the goal tag sits relative to the camera in bed mm. The tag
+        # does not move as Z drops, so this is the XY correction a descent
+        # from here needs, whatever the new scale.
+        mm_per_px = float(self._mm_per_px(goal["corners"]))
+        offset_px = goal["center"] - (region.center_x, region.center_y)
+        self.goal_offset_mm = tuple(
+            float(value) for value in self._pixels_to_mm(offset_px, mm_per_px)
+        )
+        self.goal_mm_per_px = mm_per_px
+        self.frame_short_side = 2 * min(region.center_x, region.center_y)
+
+    def _save_waypoint(self) -> None:
+        duration = None if self.started is None else self.clock() - self.started
+        self.waypoints.record(
+            self.goalTag,
+            self.xLoc,
+            self.yLoc,
+            self.zHeight,
+            iterations=self.frames,
+            duration=duration,
+            kind="warm" if self.warm_start else "calibration",
+        )
+
+    def _warm_start_confidence(self) -> float:
+        """How much to trust the goal tag's waypoint, from 0 (cold) to 1.
+
+        Recent results count for more, as do results that agree with each
+        other and sessions that converged in few frames.
+        """
+        history = [
+            entry
+            for entry in self.waypoints.history(self.goalTag, limit=5)
+            if entry.kind != "import"
+        ]
+        if not history:
+            return 0.0
+        age = time.time() - history[0].created
+        recency = max(0.0, 1 - age / self.warm_start_max_age)
+        if len(history) > 1:
+            xs = np.array([entry.x for entry in history])
+            ys = np.array([entry.y for entry in history])
+            spread = float(np.max(np.hypot(xs - xs.mean(), ys - ys.mean())))
+            agreement = max(0.0, 1 - spread / self.warm_start_max_spread)
+        else:
+            # A single run says nothing about repeatability
+            agreement = 0.5
+        frames = [entry.iterations for entry in history if entry.iterations]
+        effort = min(1.0, 60 / np.mean(frames)) if frames else 0.5
+        return recency * agreement * effort
+
+    def _plan_warm_start(self) -> None:
+        waypoint = self.waypoints.get(self.goalTag)
+        confidence = self._warm_start_confidence()
+        if waypoint is None or confidence < 0.3:
+            return
+        print(f"Warm start for tag {self.goalTag}, confidence {confidence:.2f}")
+        self.warm_start = True
+        # Start part way down the usual descent, following the same recurrence
+        # so the remaining stages and target sizes line up with a cold run
+        self.zHeight = self.zHeightStart - confidence * (
+            self.zHeightStart - self.warm_start_min_z
+        )
+        self.zChange = (self.zHeight + 70) / 10
+        self.target_scale = (((100 / self.zHeightStart) * (self.zHeight)) + 10) / 100
+        self.centered_frames_required = max(2, round(5 - 3 * confidence))
+        # Search a square around the waypoint instead of the whole bed, in
+        # steps that shrink with the camera's field of view
+        radius = self.warm_start_radius * (2 - confidence)
+        self.search_x_min = max(0, waypoint.x - radius)
+        self.search_x_max = min(self.maxLatandLonMove, waypoint.x + radius)
+        self.search_y_min = max(0, waypoint.y - radius)
+        self.search_y_max = min(self.maxLatandLonMove, waypoint.y + radius)
+        self.search_bounded = True
+        self.search_step = max(
+            1, self.incramentalMove * self.zHeight / self.zHeightStart
+        )
+
+    def _fall_back_to_cold_start(self) -> None:
+        print(f"Tag {self.goalTag} not found near its prior, starting from the top")
+        self._reset_descent()
+
+    def _determine_command(
+        self, tag_center_x: float, tag_center_y: float, region: TargetRegion
+    ) -> str:
+
+        vertical_distance = 0
+        vertical_command = ""
+        if tag_center_y < region.top:
+            vertical_distance = region.top - tag_center_y
+            vertical_command = "U"
+        elif tag_center_y > region.bottom:
+            vertical_distance = tag_center_y - region.bottom
+            vertical_command = "D"
+
+        horizontal_distance = 0
+        horizontal_command = ""
+        if tag_center_x < region.left:
+            horizontal_distance = region.left - tag_center_x
+            horizontal_command = "L"
+        elif tag_center_x > region.right:
+            horizontal_distance = tag_center_x - region.right
+            horizontal_command = "R"
+
+        if vertical_distance == 0 and horizontal_distance == 0:
+            return "C"
+        if vertical_distance >= horizontal_distance and vertical_command:
+            command = vertical_command
+        else:
+            command = horizontal_command or vertical_command or "C"
+
+        # Only the axis that is actually sent moves the target location
+        if command == "U":
+            self.yLoc = self.yLoc + self.latestDist
+            print(self.yLoc)
+        elif command == "D":
+            self.yLoc = self.yLoc - self.latestDist
+            print(self.yLoc)
+        elif command == "L":
+            self.xLoc = self.xLoc - self.latestDist
+            print(self.xLoc)
+        elif command == "R":
+            self.xLoc = self.xLoc + self.latestDist
+            print(self.xLoc)
+        return command
+
+    def _compute_distance_multiplier(
+        self, pts, center_point, region: TargetRegion
+    ) -> float:
+        dist_tag_center = math.dist((region.center_x, region.center_y), center_point)
+        tag_size = math.dist((pts[0][0], pts[0][1]), (pts[2][0], pts[2][1]))
+
+        if dist_tag_center > self.far_px:
+            dist_scale = self.far_px / self.near_px
+        elif dist_tag_center < self.near_px:
+            dist_scale = 0.1
+        else:
+            dist_scale = dist_tag_center / self.near_px
+
+        multiplier = (dist_scale * self.dist_weight) + (
+            (1 - (tag_size / self.size_ref_px)) * self.size_weight
+        )
+        self.latestDist = max(multiplier, 0.5)
+        return max(multiplier, 0.5)
+
+    def _emit_command(self, command: str, multiplier: float) -> None:
+        # ABSOLUTE-ONLY MOVEMENT: send absolute X/Y based on updated self.xLoc/self.yLoc
+        # (self.xLoc/self.yLoc are already updated in _determine_command)
+        if command == "C":
+            return
+
+        # Ensure we're in absolute mode (dropped if already set)
+        self.command_assembler.begin()
+        self.command_assembler.set_absolute()
+        self.command_assembler.use_profile(self.motion_profiles["approach"])
+        if command in ("L", "R"):
+            self.command_assembler.set_x(self.xLoc)
+        elif command in ("U", "D"):
+            self.command_assembler.set_y(self.yLoc)
+        batch = self.command_assembler.flush()
+        # Settling is timed per move in _send_batch
+        self._send_batch(batch, wait_completion=True)
+        print(batch)
+
+    def _handle_command_for_stage(self, command: str) -> None:
+        if self.calibration_complete:
+            return
+        if command == "C":
+            self.consecutive_center += 1
+        else:
+            self.consecutive_center = 0
+        if self.final_stage:
+            # The combined XY/Z move is only accepted once a frame at the final
+            # height shows the tag inside the region, otherwise centring goes on
+            if command == "C":
+                self.calibration_complete = True
+            return
+        if self.consecutive_center >= self.centered_frames_required:
+            self._advance_stage()
+
+    def _draw_overlay(self, frame, command_label: str) -> None:
+        frame_height = frame.shape[0]
+        cv2.putText(
+            frame,
+            command_label,
+            (10, 30),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            (255, 255, 255),
+            2,
+        )
+        cv2.putText(
+            frame,
+            f"Target size: {self.target_scale * 100:.1f}% of min dim",
+            (10, frame_height - 20),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.6,
+            (255, 255, 255),
+            1,
+        )
+
+    def _handle_key(self, key: int) -> bool:
+        if key == -1:
+            return True
+        if key == ord("q"):
+            return False
+        if key == self.UP_ARROW:
+            self.target_scale = min(
+                self.target_scale * (1 + self.scale_step_fraction), self.max_scale
+            )
+        elif key == self.DOWN_ARROW:
+            self.target_scale = max(
+                self.target_scale * (1 - self.scale_step_fraction), self.min_scale
+            )
+        return True
+
+    # OLD CONSTANT Z CHANGER
+    # def _ensure_stage_announced(self) -> None:
+    #     if self.stage_announced:
+    #         return
+    #     stage = self.calibration_stages[self.stage_index]
+    #     self._send_gcode(self.command_assembler.set_absolute())
+    #     self._send_gcode(self.command_assembler.zoom_in(stage), wait_completion=True)
+    #     self._send_gcode(self.command_assembler.set_relative())
+    #     if stage == "calibrated":
+    #         self.calibration_complete = True
+    #         self.stage_announced = True
+    #         return
+    #     if stage != "S1":
+    #         self.target_scale = max(self.target_scale * 0.5, self.min_scale)
+    #     self.consecutive_center = 0
+    #     self.stage_announced = True
+
+    def _change_x_span(self):
+        self.search_moves += 1
+        if self.search_bounded and self.search_moves > self.warm_start_search_moves:
+            self._fall_back_to_cold_start()
+            return
+
+        # The X step and any Y row change go out as one move
+        self.command_assembler.begin()
+        self.command_assembler.set_absolute()
+        self.command_assembler.use_profile(self.motion_profiles["travel"])
+
+        if self.xMoveDirectionPositive:
+            if (self.xIncLoc + self.search_step) >= self.search_x_max:
+                self.xMoveDirectionPositive = False
+                print(self.xMoveDirectionPositive)
+                self._change_y_span()
+                self.xIncLoc = self.xIncLoc - self.search_step
+                self.xLoc = self.xIncLoc
+            else:
+                self.xIncLoc = self.xIncLoc + self.search_step
+                self.xLoc = self.xIncLoc
+            print(self.xIncLoc)
+            self.command_assembler.set_x(self.xIncLoc)
+        else:
+            if (self.xIncLoc - self.search_step) <= self.search_x_min:
+                self.xMoveDirectionPositive = True
+                print(self.xMoveDirectionPositive)
+                self._change_y_span()
+                self.xIncLoc = self.xIncLoc + self.search_step
+                self.xLoc = self.xIncLoc
+            else:
+                self.xIncLoc = self.xIncLoc - self.search_step
+                self.xLoc = self.xIncLoc
+
+            print(self.xIncLoc)
+            self.command_assembler.set_x(self.xIncLoc)
+
+        self._send_batch(self.command_assembler.flush(), wait_completion=True)
+        # REMOVED: self._send_gcode(self.command_assembler.set_relative())
+
+    def _change_y_span(self):
+        # Only called from _change_x_span, which sends the batch
+        if self.yMoveDirectionPositive:
+            if (self.yIncLoc + self.search_step) >= self.search_y_max:
+                self.yMoveDirectionPositive = False
+                print(self.yMoveDirectionPositive)
+                self.yIncLoc = self.yIncLoc - self.search_step
+                self.yLoc = self.yIncLoc
+            else:
+                self.yIncLoc = self.yIncLoc + self.search_step
+                self.yLoc = self.yIncLoc
+            self.command_assembler.set_y(self.yIncLoc)
+        else:
+            if (self.yIncLoc - self.search_step) <= self.search_y_min:
+                self.yMoveDirectionPositive = True
+                print(self.yMoveDirectionPositive)
+                self.yIncLoc = self.yIncLoc + self.search_step
+                self.yLoc = self.yIncLoc
+            else:
+                self.yIncLoc = self.yIncLoc - self.search_step
+                self.yLoc = self.yIncLoc
+            self.command_assembler.set_y(self.yIncLoc)
+        # REMOVED: self._send_gcode(self.command_assembler.set_relative())
+
+    def _ensure_stage_announced(self) -> None:
+        if self.stage_announced:
+            return
+        stage = self.calibration_stages[self.stage_index]
+        self.command_assembler.begin()
+        self.command_assembler.set_absolute()
+        self.command_assembler.use_profile(self.motion_profiles["descent"])
+        self._correct_during_descent()
+        # print(self.zHeight)
+        self.command_assembler.zoom_in(self.zHeight)
+        # XY correction and Z go out as one G1 X Y Z, the next frame verifies
+        self._send_batch(self.command_assembler.flush(), wait_completion=True)
+        # REMOVED: self._send_gcode(self.command_assembler.set_relative())
+        if stage == "calibrated":
+            self.calibration_complete = True
+            self.stage_announced = True
+            return
+        if stage != "S1":
+            self.target_scale = max(self.target_scale * 0.5, self.min_scale)
+        self.consecutive_center = 0
+        self.stage_announced = True
+
+    def _correct_during_descent(self) -> None:
+        # Queue the XY correction predicted from the last sighting of the goal
+        # tag. Large ones are left to centring so the camera never sweeps far
+        # diagonally while dropping.
+        if self.goal_offset_mm is None:
+            return
+        offset_x, offset_y = self.goal_offset_mm
+        self.goal_offset_mm = None
+        if math.hypot(offset_x, offset_y) > self.max_descent_correction_mm:
+            return
+        self.xLoc += offset_x
+        self.yLoc += offset_y
+        self.command_assembler.set_x(self.xLoc)
+        self.command_assembler.set_y(self.yLoc)
+
+    def _advance_stage(self) -> None:
+        ladder = self._descent_ladder()
+        z = self._plan_next_z(ladder) if self.adaptive_stages else ladder[0]
+        self.zHeight = z
+        self.zChange = (self.zHeight + 70) / 10
+        self.target_scale = self._stage_scale(self.zHeight)
+        print(self.target_scale)
+        self.stage_announced = False
+        self.consecutive_center = 0
+        if self.zHeight <= ladder[-1]:
+            self.final_stage = True
+
+    def _descent_ladder(
+        self, z: Optional[float] = None, change: Optional[float] = None
+    ) -> List[float]:
+        """Heights the fixed recurrence visits from here, the final one last.
+
+        Every path ends at the final height of a cold run from zHeightStart,
+        wherever it started and however many rungs were skipped.
+        """
+        z = self.zHeight if z is None else z
+        change = self.zChange if change is None else change
+        return descent_heights(z, change, self.final_z)
+
+    def _stage_scale(self, z: float) -> float:
+        return (((100 / self.zHeightStart) * z) + 10) / 100
+
+    def _plan_next_z(self, ladder: List[float]) -> float:
+        """The lowest height on the ladder the goal tag can be dropped to now.
+
+        A height is usable when the current residual already fits inside that
+        stage's target region and the tag still fits in the frame there. A
+        tightly centred tag skips the rungs in between, down to the final
+        height once the current mm/px is within ``max_final_skip_ratio`` of
+        the final one. When even the next rung is too tight, an extra stage
+        halfway down is added (at most three per session).
+        """
+        if self.goal_offset_mm is None or self.goal_mm_per_px is None:
+            return ladder[0]
+        residual = math.hypot(*self.goal_offset_mm)
+        here = self.zHeight + self.lens_z_offset
+        side_px = self.tag_size_mm / self.goal_mm_per_px
+        best = None
+        for z in ladder:
+            ratio = (z + self.lens_z_offset) / here
+            if ratio <= 0 or side_px / ratio > self.max_tag_fraction * self.frame_short_side:
+                break
+            if z == ladder[-1] and 1 / ratio > self.max_final_skip_ratio:
+                break
+            half_side_px = max(
+                1, int(self.frame_short_side * self._stage_scale(z) / 10)
+            ) // 2
+            if residual > half_side_px * self.goal_mm_per_px * ratio:
+                break
+            best = z
+        if best is None:
+            if self.extra_stages >= 3:
+                return ladder[0]
+            self.extra_stages += 1
+            return (self.zHeight + ladder[0]) / 2
+        if best != ladder[0]:
+            print(f"Residual {residual:.2f} mm, skipping down to Z{best:.1f}")
+        return best
+
+    # OLD CODE
+    # def _advance_stage(self) -> None:
+    #     if self.stage_index < len(self.calibration_stages) - 1:
+    #         self.stage_index += 1
+    #         self.stage_announced = False
+    #         self.consecutive_center = 0
+    #         if self.calibration_stages[self.stage_index] == "calibrated":
+    #             self.calibration_complete = True
+    #     else:
+    #         self.calibration_complete = True
+
+    def _get_frame(self, url):
+        response = requests.get(url)
+        if response.status_code == 200:
+            img_array = np.asarray(bytearray(response.content), dtype=np.uint8)
+            img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+            return True, img
+        else:
+            return False, None
+
+
+LINKS = {
+    "socket": SocketLink,
+    "moonraker": MoonrakerLink,
+    "remote": RemoteMethodLink,
+    "datagram": DatagramLink,
+}
+
+
+def main(link_name: Optional[str] = None) -> None:
+    # Usage: calibratorCore.py [socket|moonraker|remote|datagram] [tag_id]
+    args = sys.argv[1:]
+    if link_name is None:
+        link_name = args.pop(0) if args else "socket"
+    if link_name not in LINKS:
+        print(f"Unknown link '{link_name}', expected one of {', '.join(LINKS)}")
+        return
+    link = LINKS[link_name]()
+    if args:
+        link.start_session(int(args[0]))
+    calibrator = AutoCalibrator(link=link)
+    try:
+        while True:
+            tag_id = link.next_session()
+            print(f"Goal Tag: {tag_id} ({link.mode})")
+            try:
+                calibrator.run_session(tag_id, link.mode)
+            except Exception as exc:
+                # One failed session must not stop the calibrator serving the printer
+                print(f"Calibration failed: {exc}")
+    finally:
+        link.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from pupil_apriltags import Detector
+
+from calibratorCore import AutoCalibrator, load_profile
+from detectionPublisher import DetectionPublisher
+from detectionService import DetectionService
+from printerLink import PrinterLink, RemoteMethodLink, SocketLink
+
+
+@dataclass
+class PrinterConfig:
+    """One printer served by the daemon, loaded from assets/printers.json."""
+
+    name: str
+    snapshot_url: str
+    link: str = "socket"
+    socket_dir: Optional[str] = None
+    uri: Optional[str] = None
+    waypoints: Optional[str] = None
+    # Tuned gains written by gainSweep.py, relative to the assets directory
+    profile: Optional[str] = None
+    publish: bool = True
+
+    def socket_path(self, filename: str) -> str:
+        return os.path.join(self.socket_dir or f"/tmp/workcell/{self.name}", filename)
+
+    def make_link(self) -> PrinterLink:
+        if self.link == "socket":
+            from klipper_comms import KlipperComms
+
+            return SocketLink(
+                KlipperComms(
+                    command_socket_path=self.socket_path("command_socket.sock"),
+                    control_socket_path=self.socket_path("control_socket.sock"),
+                )
+            )
+        if self.link == "remote":
+            return RemoteMethodLink(uri=self.uri)
+        raise ValueError(f"Unsupported link for printer {self.name}: {self.link}")
+
+
+class DetectorPool:
+    """Shared AprilTag detection for every session on the host.
+
+    pupil_apriltags releases the GIL while detecting, so a thread pool spreads
+    the work over the cores. Detector instances are not thread safe, so each
+    worker thread keeps its own.
+    """
+
+    def __init__(self, workers: Optional[int] = None, families: str = "tag36h11") -> None:
+        self.families = families
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or os.cpu_count() or 1,
+            thread_name_prefix="apriltag-detect",
+        )
+
+    def _detect(self, gray):
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = Detector(families=self.families)
+            self._local.detector = detector
+        return detector.detect(gray)
+
+    def submit(self, gray):
+        return self._executor.submit(self._detect, gray)
+
+    def detect(self, gray):
+        return self.submit(gray).result()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class PrinterSession:
+    """Calibrator, link and frame source for one printer."""
+
+    def __init__(self, config: PrinterConfig, detect: Callable) -> None:
+        self.config = config
+        self.link = config.make_link()
+        self.publisher = (
+            DetectionPublisher(config.socket_path("apriltags_detections.sock"))
+            if config.publish
+            else None
+        )
+        kwargs = {}
+        if config.profile:
+            kwargs.update(
+                load_profile(Path(__file__).resolve().parent / "assets" / config.profile)
+            )
+        if config.waypoints:
+            kwargs["filename"] = config.waypoints
+        self.calibrator = AutoCalibrator(
+            link=self.link,
+            snapshot_url=config.snapshot_url,
+            detect=detect,
+            publisher=self.publisher,
+            **kwargs,
+        )
+        self.thread = threading.Thread(
+            target=self._serve, name=f"session-{config.name}", daemon=True
+        )
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.publisher is not None:
+            self.publisher.close()
+
+    def _serve(self) -> None:
+        while not self._stop.is_set():
+            tag_id = self.link.next_session(timeout=0.5)
+            if tag_id is None:
+                continue
+            print(f"[{self.config.name}] Goal Tag: {tag_id} ({self.link.mode})")
+            try:
+                self.calibrator.run_session(tag_id, self.link.mode)
+            except Exception as exc:
+                print(f"[{self.config.name}] Calibration failed: {exc}")
+
+
+def load_config(path: Path) -> Tuple[List[PrinterConfig], str]:
+    """Printers to serve and the detection backend, "threads" or "processes"."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    printers = [PrinterConfig(**entry) for entry in data["printers"]]
+    return printers, data.get("detection", "threads")
+
+
+def main() -> None:
+    # Usage: calibratorDaemon.py [printers.json]
+    base = Path(__file__).resolve().parent
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else base / "assets" / "printers.json"
+    printers, detection = load_config(path)
+    if detection == "processes":
+        # Worker processes keep detection off this process's GIL entirely,
+        # which helps when YOLO or other Python work shares the host. The
+        # calibrator takes their DETECTION_DTYPE arrays as they are.
+        pool = DetectionService()
+    else:
+        pool = DetectorPool()
+    detect = pool.detect
+    sessions = [PrinterSession(config, detect) for config in printers]
+    for session in sessions:
+        session.start()
+        print(f"Serving {session.config.name}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping calibrator daemon")
+    finally:
+        for session in sessions:
+            session.stop()
+        for session in sessions:
+            session.thread.join(timeout=5)
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
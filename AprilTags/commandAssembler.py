@@ -1,12 +1,143 @@
 ﻿from __future__ import annotations
-from typing import List
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+
+@dataclass(frozen=True)
+class MotionLimits:
+    """The printer's [printer] limits, used to estimate move durations."""
+
+    max_velocity: float = 300.0  # mm/s
+    max_accel: float = 3000.0  # mm/s^2
+    max_z_velocity: float = 5.0
+    max_z_accel: float = 100.0
+
+    def move_profile(
+        self,
+        distance: float,
+        dz: float,
+        feedrate: Optional[float],
+        accel: Optional[float],
+    ) -> Tuple[float, float]:
+        """Cruise velocity and acceleration Klipper would use for one move."""
+        velocity = feedrate / 60 if feedrate else self.max_velocity
+        velocity = min(velocity, self.max_velocity)
+        accel = min(accel or self.max_accel, self.max_accel)
+        if dz and distance > 0:
+            # Klipper scales the whole move so the Z component stays in limits
+            z_ratio = distance / abs(dz)
+            velocity = min(velocity, self.max_z_velocity * z_ratio)
+            accel = min(accel, self.max_z_accel * z_ratio)
+        return velocity, accel
+
+    def move_duration(
+        self,
+        distance: float,
+        dz: float,
+        feedrate: Optional[float],
+        accel: Optional[float],
+    ) -> float:
+        """Seconds for one move from rest to rest on a trapezoidal profile."""
+        if distance <= 0:
+            return 0.0
+        velocity, accel = self.move_profile(distance, dz, feedrate, accel)
+        if distance <= velocity * velocity / accel:
+            # Never reaches cruise speed
+            return 2 * (distance / accel) ** 0.5
+        return distance / velocity + velocity / accel
+
+
+@dataclass(frozen=True)
+class MotionProfile:
+    """Feedrate (mm/min) and optional acceleration (mm/s^2) for one kind of move."""
+
+    name: str
+    feedrate: float
+    accel: Optional[float] = None
+
+
+# Klipper clamps these to the printer's own limits (max_velocity,
+# max_z_velocity, max_accel), so they only ever slow a move down
+MOTION_PROFILES = {
+    # Raster search hops and moves to a known position
+    "travel": MotionProfile("travel", 6000),
+    # Centring corrections of a few mm or less
+    "approach": MotionProfile("approach", 1200),
+    # Z stages
+    "descent": MotionProfile("descent", 300),
+}
+
+
+def expected_target(
+    script: str,
+    absolute: bool = True,
+    target: Optional[Dict[str, float]] = None,
+    position: Optional[Sequence[float]] = None,
+) -> Tuple[Dict[str, float], bool]:
+    """Where the commanded position ends up once ``script`` has run.
+
+    Relative moves are added to ``target`` (axes moved earlier) or else to
+    ``position`` (the toolhead's XYZ). Returns the X/Y/Z targets together
+    with the G90/G91 state after the script.
+    """
+    target = dict(target or {})
+    for line in script.splitlines():
+        words = line.split()
+        if not words:
+            continue
+        if words[0] == "G90":
+            absolute = True
+        elif words[0] == "G91":
+            absolute = False
+        elif words[0] in ("G0", "G1"):
+            for word in words[1:]:
+                axis = word[0].upper()
+                if axis not in "XYZ":
+                    continue
+                value = float(word[1:])
+                if not absolute:
+                    if axis in target:
+                        value += target[axis]
+                    elif position is not None:
+                        value += position["XYZ".index(axis)]
+                target[axis] = value
+    return target, absolute
 
 
 class CommandAssembler:
+    """Builds G-code lines for the calibrators.
+
+    Every call returns its line straight away. Between ``begin()`` and
+    ``flush()`` the assembler works as a program builder instead: it tracks the
+    modal state (G90/G91 and feedrate) so redundant switches are dropped, and
+    merges consecutive X/Y/Z targets into one ``G1``. ``flush()`` returns the
+    compact batch. ``get_program`` keeps the last ``history`` lines sent.
+
+    The assembler also follows the toolhead position through the moves it
+    emits. ``last_duration`` is the estimated run time of the last line (or
+    flushed batch), None while the start position is unknown.
+    """
+
     VALID_DIRECTIONS = {"U", "D", "L", "R", "C"}
 
-    def __init__(self) -> None:
-        self._buffer: List[str] = []
+    def __init__(
+        self, history: int = 1000, limits: Optional[MotionLimits] = None
+    ) -> None:
+        self._buffer: Deque[str] = deque(maxlen=history)
+        self.limits = limits or MotionLimits()
+        self._position: Dict[str, Optional[float]] = {"X": None, "Y": None, "Z": None}
+        self._duration: Optional[float] = 0.0
+        self.last_duration: Optional[float] = None
+        # Builder state, see begin/flush
+        self._batching = False
+        self._batch: List[str] = []
+        self._mode: Optional[str] = None  # printer's G90/G91 as far as we know
+        self._pending_mode: Optional[str] = None
+        self._feedrate: Optional[float] = None
+        self._pending_feedrate: Optional[float] = None
+        self._accel: Optional[float] = None
+        self._pending_move: Dict[str, float] = {}
         self._base_distance: float = 1.0
         self._axis_map = {
             "U": ("Y", 1.0),
@@ -24,6 +155,43 @@ class CommandAssembler:
     def home(self) -> str:
         return self._append_line("G28")
 
+    def set_feedrate(self, feedrate: float) -> str:
+        return self._append_line(f"G1 F{self._fmt_float(feedrate)}")
+
+    def set_accel(self, accel: float) -> str:
+        # Dropped when unchanged, SET_VELOCITY_LIMIT is not merged into moves
+        if accel == self._accel:
+            return ""
+        self._accel = accel
+        return self._append_line(f"SET_VELOCITY_LIMIT ACCEL={self._fmt_float(accel)}")
+
+    def use_profile(self, profile: MotionProfile) -> str:
+        """Apply a profile to the moves that follow."""
+        lines = []
+        if profile.accel is not None:
+            lines.append(self.set_accel(profile.accel))
+        lines.append(self.set_feedrate(profile.feedrate))
+        return "\n".join(line for line in lines if line)
+
+    def save_state(self, name: str = "calib") -> str:
+        return self._append_line(f"SAVE_GCODE_STATE NAME={name}")
+
+    def restore_state(self, name: str = "calib") -> str:
+        # Brings back G90/G91 and the feedrate saved earlier, so forget ours
+        line = self._append_line(f"RESTORE_GCODE_STATE NAME={name}")
+        self._mode = self._pending_mode = None
+        self._feedrate = self._pending_feedrate = None
+        return line
+
+    @property
+    def position(self) -> Dict[str, Optional[float]]:
+        """X/Y/Z followed through the emitted moves, None where unknown."""
+        return dict(self._position)
+
+    @property
+    def accel_changed(self) -> bool:
+        return self._accel is not None
+
     def move(self, direction: str, dist_multiplier: float = 1.0) -> str:
         direction_upper = direction.upper()
         if direction_upper not in self.VALID_DIRECTIONS:
@@ -81,6 +249,33 @@ class CommandAssembler:
         line = f"G1 Y{self._fmt_float(y)}"
         return self._append_line(line)
 
+    def begin(self) -> None:
+        """Start collecting lines into a batch instead of returning them one by one."""
+        self._batching = True
+        self._duration = 0.0
+
+    def set_position(self, position: Sequence[Optional[float]]) -> None:
+        """Seed the tracked XYZ, e.g. from the printer's reported position."""
+        self._position = dict(zip("XYZ", position))
+
+    def flush(self) -> List[str]:
+        """End the batch and return its compacted lines."""
+        self._flush_move()
+        if self._pending_mode is not None and self._pending_mode != self._mode:
+            self._emit(self._pending_mode)
+            self._mode = self._pending_mode
+        batch, self._batch = self._batch, []
+        self._batching = False
+        self.last_duration = self._duration
+        return batch
+
+    def invalidate(self) -> None:
+        """Forget the modal state, e.g. when something else may have changed it."""
+        self._mode = None
+        self._feedrate = None
+        self._accel = None
+        self._position = {"X": None, "Y": None, "Z": None}
+
     def get_program(self) -> str:
         return "\n".join(self._buffer)
 
@@ -91,10 +286,113 @@ class CommandAssembler:
         return self._buffer[-1] if self._buffer else None
 
     def _append_line(self, line: str) -> str:
+        if self._batching:
+            self._queue(line)
+            return line
+        self._duration = 0.0
+        self._track(line)
+        self._account(line)
+        self.last_duration = self._duration
         self._buffer.append(line)
         # print(line, flush=True)
         return line
 
+    def _track(self, line: str) -> None:
+        # Single lines still move the modal state later batches start from
+        words = line.split()
+        code = words[0].upper() if words else ""
+        if code in ("G90", "G91"):
+            self._mode = self._pending_mode = code
+        elif code in ("G0", "G1"):
+            for word in words[1:]:
+                if word[0].upper() == "F":
+                    self._feedrate = self._pending_feedrate = float(word[1:])
+
+    def _queue(self, line: str) -> None:
+        words = line.split()
+        code = words[0].upper() if words else ""
+        if code in ("G90", "G91"):
+            if self._pending_move and code != self._pending_mode:
+                self._flush_move()
+            self._pending_mode = code
+            return
+        if code in ("G0", "G1"):
+            relative = (self._pending_mode or self._mode) == "G91"
+            feedrates = [float(word[1:]) for word in words[1:] if word[0].upper() == "F"]
+            current = (
+                self._pending_feedrate
+                if self._pending_feedrate is not None
+                else self._feedrate
+            )
+            if self._pending_move and feedrates and feedrates[-1] != current:
+                # The queued move keeps the speed it was given, e.g. a travel
+                # must not turn into a slow diagonal with the descent after it
+                self._flush_move()
+            for word in words[1:]:
+                axis, value = word[0].upper(), float(word[1:])
+                if axis == "F":
+                    self._pending_feedrate = value
+                elif relative:
+                    self._pending_move[axis] = self._pending_move.get(axis, 0.0) + value
+                else:
+                    self._pending_move[axis] = value
+            return
+        self._flush_move()
+        self._emit(line)
+
+    def _flush_move(self) -> None:
+        feedrate = self._pending_feedrate
+        if feedrate == self._feedrate:
+            feedrate = None
+        if not self._pending_move and feedrate is None:
+            return
+        if self._pending_mode is not None and self._pending_mode != self._mode:
+            self._emit(self._pending_mode)
+            self._mode = self._pending_mode
+        words = ["G1"]
+        for axis in sorted(self._pending_move, key="XYZE".find):
+            words.append(f"{axis}{self._fmt_float(self._pending_move[axis])}")
+        if feedrate is not None:
+            words.append(f"F{self._fmt_float(feedrate)}")
+            self._feedrate = feedrate
+        self._emit(" ".join(words))
+        self._pending_move = {}
+        self._pending_feedrate = None
+
+    def _emit(self, line: str) -> None:
+        self._account(line)
+        self._batch.append(line)
+        self._buffer.append(line)
+
+    def _account(self, line: str) -> None:
+        # Add the move's estimated duration and advance the tracked position
+        words = line.split()
+        if not words or words[0].upper() not in ("G0", "G1"):
+            return
+        relative = self._mode == "G91"
+        deltas = {}
+        for word in words[1:]:
+            axis = word[0].upper()
+            if axis not in self._position:
+                continue
+            value = float(word[1:])
+            start = self._position[axis]
+            if relative:
+                deltas[axis] = value
+                self._position[axis] = None if start is None else start + value
+            else:
+                deltas[axis] = None if start is None else value - start
+                self._position[axis] = value
+        if self._duration is None:
+            return
+        if any(delta is None for delta in deltas.values()):
+            self._duration = None
+            return
+        distance = sum(delta * delta for delta in deltas.values()) ** 0.5
+        self._duration += self.limits.move_duration(
+            distance, deltas.get("Z", 0.0), self._feedrate, self._accel
+        )
+
     def _fmt_float(self, value: float) -> str:
         return str(int(value)) if float(value).is_integer() else f"{value:.12g}"
 
@@ -0,0 +1,253 @@
+import contextlib
+import io
+import itertools
+import json
+import math
+import sys
+import tempfile
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from pupil_apriltags import Detector
+
+from calibratorCore import AutoCalibrator
+from detectionService import DETECTION_DTYPE
+from printerLink import InProcessLink
+from printerSimulator import (
+    BedScene,
+    CameraModel,
+    SimClock,
+    SimTag,
+    VirtualGantry,
+)
+
+GOAL_TAG = 3
+# Another tag on the bed, so harvesting and goal filtering are exercised
+DISTRACTOR = SimTag(5, 160.0, 150.0)
+
+DEFAULT_TAG_POSITIONS = [(120.0, 107.5), (40.0, 180.0), (200.0, 30.0)]
+# None starts cold from the raster search, otherwise the stored waypoint is
+# this far (mm) from the tag
+DEFAULT_START_OFFSETS = [None, (3.0, 0.0), (10.0, -8.0)]
+# Corner noise in px when detections come from ground truth, image noise
+# (grey levels) when frames are rendered and detected
+DEFAULT_NOISE = [0.0, 0.5, 2.0]
+
+
+@dataclass
+class Scenario:
+    tag_x: float
+    tag_y: float
+    start_offset: Optional[Tuple[float, float]]
+    noise: float
+
+
+@dataclass
+class RunResult:
+    scenario: Scenario
+    converged: bool
+    frames: int
+    gcode_lines: int
+    round_trips: int
+    sim_time: float
+    error_mm: float
+
+
+class SimulatedSession:
+    """One calibration against a VirtualGantry on a simulated clock.
+
+    ``render`` runs pupil_apriltags on rendered frames. Otherwise the
+    detections are the ground truth corners plus Gaussian noise, which
+    isolates the control law from the detector and is much faster.
+    Each frame costs ``frame_time`` seconds (grab plus detection) and each
+    script ``round_trip`` seconds (the extension's REQUEST cycle).
+    """
+
+    def __init__(
+        self,
+        scenario: Scenario,
+        render: bool = False,
+        frame_time: float = 0.1,
+        round_trip: float = 0.05,
+        max_frames: int = 1500,
+        detector: Optional[Detector] = None,
+        calibrator_options: Optional[dict] = None,
+        seed: int = 0,
+    ) -> None:
+        self.scenario = scenario
+        self.render = render
+        self.frame_time = frame_time
+        self.round_trip = round_trip
+        self.max_frames = max_frames
+        self.rng = np.random.default_rng(seed)
+        self.clock = SimClock()
+        self.gantry = VirtualGantry(clock=self.clock)
+        camera = CameraModel(noise_std=scenario.noise if render else 0.0)
+        goal = SimTag(GOAL_TAG, scenario.tag_x, scenario.tag_y)
+        self.scene = BedScene([goal, DISTRACTOR], camera, seed=seed)
+        self.frames = 0
+        self.lines = 0
+        self.scripts = 0
+        self._tmp = tempfile.TemporaryDirectory()
+        if render:
+            if detector is None:
+                detector = Detector(families="tag36h11")
+            detect = detector.detect
+        else:
+            detect = self._detect_truth
+        link = InProcessLink(self._run_script, self._position, self._is_busy)
+        self.calibrator = AutoCalibrator(
+            link=link,
+            detect=detect,
+            filename=str(Path(self._tmp.name) / "waypoints.json"),
+            goalTag=GOAL_TAG,
+            prefetch_frames=False,
+            clock=self.clock,
+            sleep=self.clock.sleep,
+            **(calibrator_options or {}),
+        )
+        self.calibrator._get_frame = self._get_frame
+        if scenario.start_offset is not None:
+            dx, dy = scenario.start_offset
+            # An imported waypoint is used as the start but never warm starts
+            self.calibrator.waypoints.record(
+                GOAL_TAG, scenario.tag_x + dx, scenario.tag_y + dy, kind="import"
+            )
+
+    def _run_script(self, script: str) -> None:
+        self.scripts += 1
+        self.lines += len([line for line in script.splitlines() if line.strip()])
+        self.clock.sleep(self.round_trip)
+        self.gantry.execute(script)
+
+    def _position(self):
+        return self.gantry.commanded
+
+    def _is_busy(self) -> bool:
+        # Nothing else runs meanwhile, skip straight to the end of the moves
+        self.clock.advance_to(self.gantry.busy_until)
+        return False
+
+    def _get_frame(self, url):
+        if self.frames >= self.max_frames:
+            return False, None
+        self.frames += 1
+        self.clock.sleep(self.frame_time)
+        camera = self.scene.camera
+        if not self.render:
+            return True, np.zeros((camera.height, camera.width, 3), dtype=np.uint8)
+        return True, self.scene.render(self.gantry.actual_at())
+
+    def _detect_truth(self, gray) -> np.ndarray:
+        camera = self.scene.camera
+        # Mosaic tiles are smaller than frames and carry no truth here
+        if gray.shape != (camera.height, camera.width):
+            return np.zeros(0, dtype=DETECTION_DTYPE)
+        truth = self.scene.ground_truth(self.gantry.actual_at())
+        result = np.zeros(len(truth), dtype=DETECTION_DTYPE)
+        for row, (tag_id, corners) in zip(result, truth.items()):
+            corners = corners + self.rng.normal(0, self.scenario.noise, corners.shape)
+            row["tag_id"] = tag_id
+            row["corners"] = corners
+            row["center"] = corners.mean(axis=0)
+            row["decision_margin"] = 80.0
+            row["hamming"] = 0
+        return result
+
+    def run(self) -> RunResult:
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.calibrator.run_session(GOAL_TAG)
+        x, y = self.scene.view_centre(self.gantry.actual_at())
+        # Only a finished calibration is saved
+        history = self.calibrator.waypoints.history(GOAL_TAG)
+        converged = any(entry.kind in ("calibration", "warm") for entry in history)
+        for store in (
+            self.calibrator.waypoints,
+            self.calibrator.patches,
+            self.calibrator.mosaic,
+        ):
+            store.close()
+        self._tmp.cleanup()
+        return RunResult(
+            self.scenario,
+            converged=converged,
+            frames=self.frames,
+            gcode_lines=self.lines,
+            round_trips=self.scripts,
+            sim_time=self.clock(),
+            error_mm=math.hypot(x - self.scenario.tag_x, y - self.scenario.tag_y),
+        )
+
+
+def summarise(results: List[RunResult]) -> dict:
+    converged = [result for result in results if result.converged]
+    summary = {"runs": len(results), "converged": len(converged)}
+    for key in ("frames", "gcode_lines", "round_trips", "sim_time", "error_mm"):
+        values = [getattr(result, key) for result in converged]
+        summary[key] = float(np.mean(values)) if values else None
+    return summary
+
+
+def compare(summary: dict, baseline: dict, tolerance: float = 0.1) -> List[str]:
+    """Metrics that got worse than ``baseline`` by more than ``tolerance``."""
+    regressions = []
+    if summary["converged"] < baseline["converged"]:
+        regressions.append(
+            f"converged {summary['converged']} < {baseline['converged']}"
+        )
+    for key in ("gcode_lines", "round_trips", "sim_time", "error_mm"):
+        now, before = summary.get(key), baseline.get(key)
+        if now is None or not before:
+            continue
+        if now > before * (1 + tolerance):
+            regressions.append(f"{key} {now:.3f} vs {before:.3f}")
+    return regressions
+
+
+def main() -> None:
+    # Usage: convergenceBenchmark.py [results.json] [baseline.json|""] [render]
+    output = Path(sys.argv[1] if len(sys.argv) > 1 else "convergence_benchmark.json")
+    baseline_path = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] else None
+    render = len(sys.argv) > 3 and sys.argv[3] == "render"
+    noise_levels = [0.0, 3.0, 8.0] if render else DEFAULT_NOISE
+    detector = Detector(families="tag36h11") if render else None
+
+    results = []
+    for (tag_x, tag_y), offset, noise in itertools.product(
+        DEFAULT_TAG_POSITIONS, DEFAULT_START_OFFSETS, noise_levels
+    ):
+        scenario = Scenario(tag_x, tag_y, offset, noise)
+        result = SimulatedSession(scenario, render=render, detector=detector).run()
+        results.append(result)
+        print(
+            f"tag ({tag_x:g}, {tag_y:g}) start {offset} noise {noise:g}:"
+            f" {'converged' if result.converged else 'FAILED'} in {result.frames}"
+            f" frames, {result.gcode_lines} lines / {result.round_trips} round trips,"
+            f" {result.sim_time:.1f} s, error {result.error_mm:.3f} mm"
+        )
+    summary = summarise(results)
+    print(json.dumps(summary, indent=2))
+    if baseline_path is not None:
+        with open(baseline_path, "r") as f:
+            regressions = compare(summary, json.load(f)["summary"])
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if not regressions:
+            print("No regressions against the baseline")
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "mode": "render" if render else "truth",
+                "summary": summary,
+                "runs": [asdict(result) for result in results],
+            },
+            f,
+            indent=2,
+        )
+    print(f"Wrote {len(results)} runs to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from detectionService import DETECTION_DTYPE, to_array
+
+DEFAULT_SOCKET_PATH = "/tmp/apriltags_detections.sock"
+
+
+class _Subscriber:
+    def __init__(self, conn: socket.socket, tag_ids, max_rate) -> None:
+        self.conn = conn
+        self.tag_ids = None if tag_ids is None else {int(tag_id) for tag_id in tag_ids}
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.last_sent = 0.0
+        # Tail of a message the socket only partly accepted
+        self.pending = b""
+
+
+class DetectionPublisher:
+    """Share every detection pass with local subscribers.
+
+    Subscribers connect to a Unix stream socket and may send one JSON line
+    such as ``{"tag_ids": [3], "max_rate": 5}`` to filter by tag and limit the
+    message rate. Each frame is then delivered as one JSON line::
+
+        {"frame_id": 12, "timestamp": 1700000000.1,
+         "detections": [{"id": 3, "center": [..], "corners": [..], "margin": 80.2}]}
+
+    Sends never block the detection loop, a subscriber that falls behind just
+    misses frames.
+    """
+
+    def __init__(self, path: str = DEFAULT_SOCKET_PATH) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        os.chmod(path, 0o666)
+        self._server.listen(8)
+        self._subscribers: List[_Subscriber] = []
+        self._lock = threading.Lock()
+        self._running = True
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+
+    def _accept_loop(self) -> None:
+        while self._running:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                break
+            tag_ids, max_rate = None, None
+            conn.settimeout(0.2)
+            try:
+                line = conn.recv(1024).split(b"\n", 1)[0]
+                if line:
+                    request = json.loads(line)
+                    tag_ids = request.get("tag_ids")
+                    max_rate = request.get("max_rate")
+            except (socket.timeout, ValueError):
+                pass
+            except OSError:
+                conn.close()
+                continue
+            conn.setblocking(False)
+            with self._lock:
+                self._subscribers.append(_Subscriber(conn, tag_ids, max_rate))
+
+    def publish(self, frame_id: int, detections, timestamp: Optional[float] = None) -> None:
+        """Send a frame's detections (Detector.detect output or a DETECTION_DTYPE array)."""
+        if not self._subscribers:
+            return
+        if not isinstance(detections, np.ndarray) or detections.dtype != DETECTION_DTYPE:
+            detections = to_array(detections)
+        timestamp = time.time() if timestamp is None else timestamp
+        now = time.monotonic()
+        encoded = {}
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                if subscriber.pending:
+                    # Finish the half-sent line first, the frame is skipped
+                    sent = subscriber.conn.send(subscriber.pending)
+                    subscriber.pending = subscriber.pending[sent:]
+                    continue
+                if now - subscriber.last_sent < subscriber.min_interval:
+                    continue
+                key = None if subscriber.tag_ids is None else frozenset(subscriber.tag_ids)
+                if key not in encoded:
+                    encoded[key] = self._encode(
+                        frame_id, timestamp, detections, subscriber.tag_ids
+                    )
+                sent = subscriber.conn.send(encoded[key])
+                subscriber.pending = encoded[key][sent:]
+                subscriber.last_sent = now
+            except BlockingIOError:
+                continue
+            except OSError:
+                self._drop(subscriber)
+
+    @staticmethod
+    def _encode(frame_id, timestamp, detections, tag_ids) -> bytes:
+        if tag_ids is not None:
+            detections = detections[np.isin(detections["tag_id"], list(tag_ids))]
+        message = {
+            "frame_id": frame_id,
+            "timestamp": round(timestamp, 3),
+            "detections": [
+                {
+                    "id": int(row["tag_id"]),
+                    "center": np.round(row["center"], 2).tolist(),
+                    "corners": np.round(row["corners"], 2).tolist(),
+                    "margin": round(float(row["decision_margin"]), 2),
+                }
+                for row in detections
+            ],
+        }
+        return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+    def _drop(self, subscriber: _Subscriber) -> None:
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+        subscriber.conn.close()
+
+    def close(self) -> None:
+        self._running = False
+        self._server.close()
+        with self._lock:
+            for subscriber in self._subscribers:
+                subscriber.conn.close()
+            self._subscribers = []
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def subscribe(
+    path: str = DEFAULT_SOCKET_PATH,
+    tag_ids: Optional[Sequence[int]] = None,
+    max_rate: Optional[float] = None,
+) -> Iterator[dict]:
+    """Yield detection messages from a DetectionPublisher."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    request = {}
+    if tag_ids is not None:
+        request["tag_ids"] = list(tag_ids)
+    if max_rate is not None:
+        request["max_rate"] = max_rate
+    sock.sendall((json.dumps(request) + "\n").encode())
+    buffer = b""
+    try:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line:
+                    yield json.loads(line)
+    finally:
+        sock.close()
+
+
+def main() -> None:
+    # Usage: detectionPublisher.py [socket_path] [tag_id ...]
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SOCKET_PATH
+    tag_ids = [int(tag_id) for tag_id in sys.argv[2:]] or None
+    for message in subscribe(path, tag_ids):
+        print(message)
+
+
+if __name__ == "__main__":
+    main()
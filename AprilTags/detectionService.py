@@ -0,0 +1,159 @@
+import multiprocessing
+import os
+import queue
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+# One row per detection, small enough to send back from the workers cheaply
+DETECTION_DTYPE = np.dtype(
+    [
+        ("tag_id", np.int32),
+        ("center", np.float32, (2,)),
+        ("corners", np.float32, (4, 2)),
+        ("decision_margin", np.float32),
+        ("hamming", np.int8),
+    ]
+)
+
+
+class Detection(NamedTuple):
+    """Stand-in for pupil_apriltags.Detection built from a DETECTION_DTYPE row."""
+
+    tag_id: int
+    center: np.ndarray
+    corners: np.ndarray
+    decision_margin: float
+    hamming: int
+
+
+def to_array(detections) -> np.ndarray:
+    """Pack pupil_apriltags detections into a DETECTION_DTYPE array."""
+    result = np.zeros(len(detections), dtype=DETECTION_DTYPE)
+    for row, detection in zip(result, detections):
+        row["tag_id"] = detection.tag_id
+        row["center"] = detection.center
+        row["corners"] = detection.corners
+        row["decision_margin"] = detection.decision_margin
+        row["hamming"] = detection.hamming
+    return result
+
+
+def as_detections(array: np.ndarray) -> List[Detection]:
+    """Unpack a DETECTION_DTYPE array for code written against Detector.detect."""
+    return [
+        Detection(
+            int(row["tag_id"]),
+            row["center"].astype(float),
+            row["corners"].astype(float),
+            float(row["decision_margin"]),
+            int(row["hamming"]),
+        )
+        for row in array
+    ]
+
+
+_detector = None
+
+
+def _init_worker(families: str, detector_kwargs: dict) -> None:
+    global _detector
+    from pupil_apriltags import Detector
+
+    _detector = Detector(families=families, **detector_kwargs)
+
+
+def _attach(name: str) -> SharedMemory:
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    # Pool workers share the service's resource tracker, so registering the
+    # segment again here is harmless and the service stays its only owner
+    return SharedMemory(name=name)
+
+
+def _detect_shared(name: str, shape) -> np.ndarray:
+    shm = _attach(name)
+    try:
+        gray = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        detections = _detector.detect(gray)
+        del gray
+    finally:
+        shm.close()
+    return to_array(detections)
+
+
+class DetectionService:
+    """Process pool of warm AprilTag detectors.
+
+    Frames are copied once into a shared-memory slot and only the slot name is
+    sent to a worker, which returns a DETECTION_DTYPE array. ``submit`` returns
+    a future; when every slot is in use it blocks until one is free.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        families: str = "tag36h11",
+        slots: Optional[int] = None,
+        start_method: str = "spawn",
+        **detector_kwargs,
+    ) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(families, detector_kwargs),
+        )
+        self._slots: List[Optional[SharedMemory]] = [None] * (slots or 2 * self.workers)
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for index in range(len(self._slots)):
+            self._free.put(index)
+
+    def submit(self, gray: np.ndarray) -> Future:
+        if gray.ndim != 2 or gray.dtype != np.uint8:
+            raise ValueError("DetectionService expects a 2D uint8 grayscale frame")
+        index = self._free.get()
+        try:
+            shm = self._slot(index, gray.nbytes)
+            np.ndarray(gray.shape, dtype=np.uint8, buffer=shm.buf)[:] = gray
+            future = self._executor.submit(_detect_shared, shm.name, gray.shape)
+        except Exception:
+            self._free.put(index)
+            raise
+        future.add_done_callback(lambda _future: self._free.put(index))
+        return future
+
+    def detect(self, gray: np.ndarray) -> np.ndarray:
+        return self.submit(gray).result()
+
+    def _slot(self, index: int, nbytes: int) -> SharedMemory:
+        shm = self._slots[index]
+        if shm is None or shm.size < nbytes:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = SharedMemory(create=True, size=nbytes)
+            self._slots[index] = shm
+        return shm
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        for shm in self._slots:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self._slots = [None] * len(self._slots)
+
+    def __enter__(self) -> "DetectionService":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    print("This module is intended to be imported, not run directly.")
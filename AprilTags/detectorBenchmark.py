@@ -0,0 +1,237 @@
+import itertools
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import cv2
+import numpy as np
+from pupil_apriltags import Detector
+
+from calibratorCore import descent_heights
+from printerSimulator import BedScene, SimTag
+
+# Every combination is benchmarked, keep it small or pass a grid JSON
+DEFAULT_GRID = {
+    "scale": [1.0, 0.5],
+    "quad_decimate": [1.0, 2.0],
+    "quad_sigma": [0.0, 0.8],
+    "refine_edges": [True, False],
+    "nthreads": [1, 4],
+}
+
+
+@dataclass
+class CorpusFrame:
+    name: str
+    gray: np.ndarray
+    # tag_id -> (4, 2) corners in pixel edge coordinates, None when unknown
+    truth: Optional[Dict[int, np.ndarray]] = None
+    z: Optional[float] = None
+
+
+@dataclass
+class DetectorConfig:
+    scale: float = 1.0
+    quad_decimate: float = 2.0
+    quad_sigma: float = 0.0
+    refine_edges: bool = True
+    nthreads: int = 1
+
+    def make_detector(self) -> Detector:
+        return Detector(
+            families="tag36h11",
+            nthreads=self.nthreads,
+            quad_decimate=self.quad_decimate,
+            quad_sigma=self.quad_sigma,
+            refine_edges=int(self.refine_edges),
+        )
+
+
+def synthetic_corpus(
+    z_start: float = 115,
+    frames_per_stage: int = 4,
+    max_offset_mm: float = 15.0,
+    seed: int = 0,
+) -> List[CorpusFrame]:
+    """Rendered frames over a tag at every height of a cold descent."""
+    tags = [SimTag(3, 120.0, 107.5), SimTag(5, 150.0, 80.0, angle=30.0)]
+    scene = BedScene(tags, seed=seed)
+    rng = np.random.default_rng(seed)
+    frames = []
+    for z in [z_start] + descent_heights(z_start, z_start / 10):
+        # The view narrows as Z drops, keep the offsets inside it
+        reach = max_offset_mm * (z + scene.camera.lens_z_offset) / (
+            z_start + scene.camera.lens_z_offset
+        )
+        for index in range(frames_per_stage):
+            dx, dy = rng.uniform(-reach, reach, 2)
+            position = (tags[0].x + dx, tags[0].y + dy, z)
+            frame = scene.render(position)
+            frames.append(
+                CorpusFrame(
+                    f"z{z:.1f}_{index}",
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY),
+                    scene.ground_truth(position),
+                    z,
+                )
+            )
+    return frames
+
+
+def recorded_corpus(directory: Path) -> List[CorpusFrame]:
+    """Field frames from ``directory``.
+
+    Ground truth is optional, from ``ground_truth.json`` in the same
+    directory: {"frame.png": {"3": [[x, y], [x, y], [x, y], [x, y]]}}.
+    Frames without it only count towards latency.
+    """
+    truth_path = directory / "ground_truth.json"
+    truths = {}
+    if truth_path.exists():
+        with open(truth_path, "r") as f:
+            truths = json.load(f)
+    frames = []
+    for path in sorted(directory.iterdir()):
+        if path.suffix.lower() not in (".png", ".jpg", ".jpeg", ".bmp"):
+            continue
+        gray = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            print(f"Unable to read {path}")
+            continue
+        truth = truths.get(path.name)
+        if truth is not None:
+            truth = {int(key): np.array(corners) for key, corners in truth.items()}
+        frames.append(CorpusFrame(path.name, gray, truth))
+    return frames
+
+
+def _percentiles(values: Iterable[float]) -> Dict[str, float]:
+    values = np.asarray(list(values), dtype=float)
+    if len(values) == 0:
+        return {}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        "mean": float(values.mean()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+    }
+
+
+def benchmark(
+    config: DetectorConfig, corpus: List[CorpusFrame], repeats: int = 1
+) -> dict:
+    """Latency, recall and corner error of one detector setting."""
+    detector = config.make_detector()
+    frames = []
+    for item in corpus:
+        gray = item.gray
+        if config.scale != 1:
+            gray = cv2.resize(
+                gray,
+                None,
+                fx=config.scale,
+                fy=config.scale,
+                interpolation=cv2.INTER_AREA,
+            )
+        frames.append(np.ascontiguousarray(gray))
+    # The first call allocates the detector's buffers
+    detector.detect(frames[0])
+
+    latencies = []
+    expected = found = false_positives = 0
+    corner_errors = []
+    # Recall per stage height, small tags at the top are the hard case
+    by_z: Dict[float, List[int]] = {}
+    for _ in range(repeats):
+        for item, gray in zip(corpus, frames):
+            started = time.perf_counter()
+            detections = detector.detect(gray)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if item.truth is None:
+                continue
+            expected += len(item.truth)
+            hits = 0
+            for detection in detections:
+                truth = item.truth.get(detection.tag_id)
+                if truth is None:
+                    false_positives += 1
+                    continue
+                hits += 1
+                # Back to full resolution; edge coordinates scale exactly
+                corners = np.asarray(detection.corners) / config.scale
+                # Detectors disagree on the starting corner, pair by distance
+                distances = np.linalg.norm(corners[:, None] - truth[None], axis=-1)
+                corner_errors.extend(distances.min(axis=1))
+            found += hits
+            if item.z is not None:
+                counts = by_z.setdefault(round(item.z, 1), [0, 0])
+                counts[0] += hits
+                counts[1] += len(item.truth)
+    total = sum(latencies) / 1000
+    return {
+        "config": asdict(config),
+        "frames": len(latencies),
+        "latency_ms": _percentiles(latencies),
+        "fps": len(latencies) / total if total else None,
+        "recall": found / expected if expected else None,
+        "recall_by_z": {
+            str(z): hits / tags for z, (hits, tags) in by_z.items() if tags
+        },
+        "false_positives": false_positives,
+        "corner_error_px": _percentiles(corner_errors),
+    }
+
+
+def grid_configs(grid: dict) -> List[DetectorConfig]:
+    keys = list(grid)
+    return [
+        DetectorConfig(**dict(zip(keys, values)))
+        for values in itertools.product(*(grid[key] for key in keys))
+    ]
+
+
+def main() -> None:
+    # Usage: detectorBenchmark.py [results.json] [frames_dir|""] [grid.json]
+    output = Path(sys.argv[1] if len(sys.argv) > 1 else "detector_benchmark.json")
+    corpus = synthetic_corpus()
+    recorded = 0
+    if len(sys.argv) > 2 and sys.argv[2]:
+        field_frames = recorded_corpus(Path(sys.argv[2]))
+        recorded = len(field_frames)
+        corpus += field_frames
+    grid = DEFAULT_GRID
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], "r") as f:
+            grid = {**DEFAULT_GRID, **json.load(f)}
+
+    results = []
+    for config in grid_configs(grid):
+        result = benchmark(config, corpus)
+        results.append(result)
+        recall = result["recall"]
+        error = result["corner_error_px"].get("mean")
+        print(
+            f"{config}: p50 {result['latency_ms']['p50']:.1f} ms,"
+            f" p99 {result['latency_ms']['p99']:.1f} ms, {result['fps']:.0f} fps,"
+            f" recall {'n/a' if recall is None else f'{recall:.3f}'},"
+            f" corner error {'n/a' if error is None else f'{error:.2f}'} px"
+        )
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "created": time.time(),
+                "corpus": {"synthetic": len(corpus) - recorded, "recorded": recorded},
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Wrote {len(results)} results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,144 @@
 ﻿import asyncio
-import json
-import itertools
-from typing import Optional
-
-import websockets
-
-
-class CameraController:
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from moonrakerClient import MoonrakerClient
+
+
+TOOLHEAD_OBJECTS = {
+    "toolhead": ["position", "print_time", "estimated_print_time", "homed_axes"],
+    "motion_report": ["live_position", "live_velocity"],
+    "gcode_move": ["gcode_position"],
+}
+
+
+@dataclass(frozen=True)
+class ToolheadSnapshot:
+    """Immutable view of the toolhead built from Moonraker status updates.
+
+    ``position`` is in toolhead coordinates, with any bed mesh adjustment and
+    SET_GCODE_OFFSET applied, like ``live_position``. ``gcode_position`` is
+    the same point in the coordinates G-code moves are written in.
+    """
+
+    position: Tuple[float, float, float]
+    gcode_position: Tuple[float, float, float]
+    live_position: Tuple[float, float, float]
+    live_velocity: float
+    print_time: float
+    estimated_print_time: float
+    eventtime: float
+
+    def is_idle(self, tolerance: float = 0.05) -> bool:
+        """True once every queued move has run and the gantry has stopped."""
+        return (
+            self.estimated_print_time >= self.print_time
+            and abs(self.live_velocity) < 1e-3
+            and all(
+                abs(live - commanded) <= tolerance
+                for live, commanded in zip(self.live_position, self.position)
+            )
+        )
+
+    def at(self, target: Dict[str, float], tolerance: float = 0.05) -> bool:
+        """True if the G-code position matches ``target`` ({"X": 10, ...})."""
+        axes = {"X": 0, "Y": 1, "Z": 2}
+        return all(
+            abs(self.gcode_position[axes[axis.upper()]] - value) <= tolerance
+            for axis, value in target.items()
+        )
+
+
+class CameraController(MoonrakerClient):
     """Manage a persistent Moonraker WebSocket connection and send raw G-code."""
 
-    def __init__(self) -> None:
-        self.uri = "ws://192.168.0.100:7125/websocket"
-        self.websocket: Optional[websockets.WebSocketClientProtocol] = None
-        self.running = False
-        self._id_iter = itertools.count(1)
-
-    async def connect(self) -> bool:
-        """Connect to Moonraker and keep the socket open for future commands."""
+    def __init__(self, uri: str = "ws://192.168.0.100:7125/websocket") -> None:
+        super().__init__(uri)
+        # Replaced wholesale on every status update, so readers never need a lock
+        self.toolhead: Optional[ToolheadSnapshot] = None
+        self._status: Dict[str, dict] = {}
+        self._status_changed: Optional[asyncio.Event] = None
+
+    async def subscribe_toolhead(self) -> bool:
+        """Subscribe once to toolhead and motion_report status updates."""
+        if self._status_changed is None:
+            self._status_changed = asyncio.Event()
+            self.subscribe("notify_status_update", self._on_status_update)
+            self.on_reconnect(self._resubscribe_toolhead)
         try:
-            self.websocket = await websockets.connect(self.uri)
-            self._id_iter = itertools.count(1)
-            self.running = True
-            print("Connected to Moonraker websocket - connection will stay open")
-            return True
+            result = await self.call(
+                "printer.objects.subscribe", {"objects": TOOLHEAD_OBJECTS}
+            )
         except Exception as exc:
-            print(f"Failed to connect: {exc}")
-            self.running = False
-            self.websocket = None
+            print(f"Toolhead subscription failed: {exc}")
             return False
+        self._on_status_update([result.get("status", {}), result.get("eventtime", 0.0)])
+        return True
+
+    async def _resubscribe_toolhead(self) -> None:
+        self._status = {}
+        await self.subscribe_toolhead()
 
-    async def disconnect(self) -> None:
-        """Close the existing WebSocket connection."""
-        if self.websocket is not None:
-            await self.websocket.close()
-        self.running = False
-        self.websocket = None
-        print("Connection closed")
+    def _on_status_update(self, params) -> None:
+        if not params:
+            return
+        for name, fields in params[0].items():
+            self._status.setdefault(name, {}).update(fields)
+        toolhead = self._status.get("toolhead", {})
+        motion = self._status.get("motion_report", {})
+        gcode_move = self._status.get("gcode_move", {})
+        if "position" not in toolhead:
+            return
+        position = tuple(toolhead["position"][:3])
+        eventtime = params[1] if len(params) > 1 else 0.0
+        self.toolhead = ToolheadSnapshot(
+            position=position,
+            gcode_position=tuple(gcode_move.get("gcode_position", position)[:3]),
+            live_position=tuple(motion.get("live_position", position)[:3]),
+            live_velocity=motion.get("live_velocity", 0.0),
+            print_time=toolhead.get("print_time", 0.0),
+            estimated_print_time=toolhead.get("estimated_print_time", 0.0),
+            eventtime=eventtime,
+        )
+        # Wake every waiter and hand out a fresh event for the next update
+        changed, self._status_changed = self._status_changed, asyncio.Event()
+        changed.set()
+
+    async def wait_idle(
+        self,
+        target: Optional[Dict[str, float]] = None,
+        tolerance: float = 0.05,
+        timeout: float = 30.0,
+    ) -> Optional[ToolheadSnapshot]:
+        """Wait until the gantry is idle, and at ``target`` if one is given."""
+        if self._status_changed is None:
+            raise RuntimeError("Call subscribe_toolhead() before wait_idle()")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            snapshot = self.toolhead
+            if snapshot is not None and snapshot.is_idle(tolerance):
+                if target is None or snapshot.at(target, tolerance):
+                    return snapshot
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError("Toolhead did not reach an idle state")
+            try:
+                await asyncio.wait_for(self._status_changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
 
     async def send_gcode(self, gcode: str) -> Optional[dict]:
-        """Send a block of raw G-code over the active connection."""
+        """Send a block of raw G-code and wait for Moonraker to acknowledge it."""
         if not gcode:
             print("No G-code provided")
             return None
-        if not self.websocket or not self.running:
+        if self.websocket is None:
             print("WebSocket not connected")
             return None
 
-        request_id = next(self._id_iter)
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "printer.gcode.script",
-            "params": {"script": gcode},
-            "id": request_id,
-        }
-
         try:
-            await self.websocket.send(json.dumps(payload))
-            response = await self._await_response(request_id)
+            response = await self.call("printer.gcode.script", {"script": gcode})
             print("Command executed")
             return response
         except RuntimeError as err:
@@ -65,21 +147,9 @@ class CameraController:
             print(f"Error communicating with Moonraker: {exc}")
         return None
 
-    async def _await_response(self, request_id: int) -> dict:
-        """Listen until Moonraker replies to the provided request id."""
-        assert self.websocket is not None
-        while True:
-            raw_message = await self.websocket.recv()
-            message = json.loads(raw_message)
-
-            if message.get("id") == request_id:
-                if "error" in message:
-                    raise RuntimeError(message["error"])
-                return message
-
-            method = message.get("method")
-            if method == "notify_gcode_response":
-                continue
+    def send_gcode_nowait(self, gcode: str) -> asyncio.Future:
+        """Queue a block of G-code and return its future so the caller can keep working."""
+        return self.call_nowait("printer.gcode.script", {"script": gcode})
 
 
 def main() -> None:
@@ -0,0 +1,205 @@
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from convergenceBenchmark import Scenario, SimulatedSession
+
+# Values tried by a grid search, and the ranges a random search draws from
+DEFAULT_SPACE = {
+    "dist_weight": [0.4, 0.8, 1.2],
+    "size_weight": [0.1, 0.2, 0.4],
+    "incramentalMove": [20, 30, 40],
+    "zHeightStart": [95, 115],
+    "target_scale": [0.8, 1.0, 1.2],
+    "near_px": [30, 50, 80],
+    "far_px": [200, 250, 300],
+    "size_ref_px": [150, 200, 250],
+}
+INTEGER_PARAMS = {"incramentalMove", "zHeightStart"}
+
+# A cold search and an offset start for two tag positions, noisy corners
+SWEEP_SCENARIOS = [
+    Scenario(tag_x, tag_y, offset, 0.5)
+    for (tag_x, tag_y), offset in itertools.product(
+        [(120.0, 107.5), (40.0, 180.0)], [None, (10.0, -8.0)]
+    )
+]
+
+
+def evaluate(params: Dict[str, float]) -> dict:
+    """Mean simulated calibration of ``params`` over SWEEP_SCENARIOS."""
+    results = [
+        SimulatedSession(scenario, calibrator_options=params).run()
+        for scenario in SWEEP_SCENARIOS
+    ]
+    converged = [result for result in results if result.converged]
+
+    def mean(key):
+        values = [getattr(result, key) for result in converged]
+        return float(np.mean(values)) if values else None
+
+    return {
+        "params": params,
+        "converged": len(converged),
+        "runs": len(results),
+        "sim_time": mean("sim_time"),
+        "gcode_lines": mean("gcode_lines"),
+        "error_mm": mean("error_mm"),
+        "max_error_mm": max((result.error_mm for result in converged), default=None),
+    }
+
+
+def rank(evaluations: List[dict], max_error_mm: float) -> List[dict]:
+    """Fastest first among configurations that always reach ``max_error_mm``."""
+
+    def key(evaluation):
+        feasible = (
+            evaluation["converged"] == evaluation["runs"]
+            and evaluation["max_error_mm"] <= max_error_mm
+        )
+        return (not feasible, evaluation["sim_time"] or float("inf"))
+
+    return sorted(evaluations, key=key)
+
+
+def grid_candidates(space: Dict[str, list]) -> List[Dict[str, float]]:
+    keys = list(space)
+    return [
+        dict(zip(keys, values))
+        for values in itertools.product(*(space[key] for key in keys))
+    ]
+
+
+def _clip(space: Dict[str, list], key: str, value: float) -> float:
+    value = min(max(value, min(space[key])), max(space[key]))
+    return int(round(value)) if key in INTEGER_PARAMS else float(value)
+
+
+def random_candidates(
+    space: Dict[str, list], count: int, rng: np.random.Generator
+) -> List[Dict[str, float]]:
+    return [
+        {
+            key: _clip(space, key, rng.uniform(min(values), max(values)))
+            for key, values in space.items()
+        }
+        for _ in range(count)
+    ]
+
+
+def refine_candidates(
+    space: Dict[str, list],
+    best: List[dict],
+    count: int,
+    rng: np.random.Generator,
+    spread: float = 0.15,
+) -> List[Dict[str, float]]:
+    # Perturb the leaders by a fraction of each parameter's range
+    candidates = []
+    for index in range(count):
+        parent = best[index % len(best)]["params"]
+        candidates.append(
+            {
+                key: _clip(
+                    space,
+                    key,
+                    parent[key]
+                    + rng.normal(0, spread * (max(values) - min(values) or 1)),
+                )
+                for key, values in space.items()
+            }
+        )
+    return candidates
+
+
+def sweep(
+    space: Dict[str, list],
+    method: str = "random",
+    budget: int = 64,
+    rounds: int = 3,
+    max_error_mm: float = 0.5,
+    workers: Optional[int] = None,
+    seed: int = 0,
+) -> List[dict]:
+    """Evaluate configurations in parallel and return them ranked.
+
+    "grid" tries every combination in ``space``. "random" spends
+    ``budget`` evaluations over ``rounds``: the first samples the ranges
+    uniformly, later ones perturb the best quarter so far.
+    """
+    rng = np.random.default_rng(seed)
+    evaluations: List[dict] = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        if method == "grid":
+            evaluations = list(pool.map(evaluate, grid_candidates(space)))
+            return rank(evaluations, max_error_mm)
+        per_round = max(1, budget // rounds)
+        candidates = random_candidates(space, per_round, rng)
+        for round_index in range(rounds):
+            evaluations += pool.map(evaluate, candidates)
+            ranked = rank(evaluations, max_error_mm)
+            leader = ranked[0]
+            print(
+                f"Round {round_index + 1}: {len(evaluations)} evaluated, best"
+                f" {leader['sim_time']} s, max error {leader['max_error_mm']} mm"
+            )
+            leaders = ranked[: max(1, len(ranked) // 4)]
+            candidates = refine_candidates(space, leaders, per_round, rng)
+    return rank(evaluations, max_error_mm)
+
+
+def main() -> None:
+    # Usage: gainSweep.py [profile.json] [random|grid] [budget] [space.json]
+    base = Path(__file__).resolve().parent
+    output = base / "assets" / "calibrator_profile.json"
+    if len(sys.argv) > 1:
+        output = Path(sys.argv[1])
+    method = sys.argv[2] if len(sys.argv) > 2 else "random"
+    budget = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    space = DEFAULT_SPACE
+    if len(sys.argv) > 4:
+        with open(sys.argv[4], "r") as f:
+            space = {**DEFAULT_SPACE, **json.load(f)}
+    max_error_mm = 0.5
+
+    baseline = evaluate({})
+    print(
+        f"Current defaults: {baseline['sim_time']} s,"
+        f" max error {baseline['max_error_mm']} mm"
+    )
+    ranked = sweep(space, method, budget, max_error_mm=max_error_mm)
+    best = ranked[0]
+    if best["converged"] < best["runs"] or best["max_error_mm"] > max_error_mm:
+        print(f"No configuration reached {max_error_mm} mm on every run, no profile")
+        return
+    for evaluation in ranked[:5]:
+        print(
+            f"{evaluation['sim_time']:.1f} s,"
+            f" max error {evaluation['max_error_mm']:.3f} mm: {evaluation['params']}"
+        )
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "created": time.time(),
+                "method": method,
+                "max_error_mm": max_error_mm,
+                "scenarios": len(SWEEP_SCENARIOS),
+                "baseline": baseline,
+                "params": best["params"],
+                "score": {key: value for key, value in best.items() if key != "params"},
+            },
+            f,
+            indent=2,
+        )
+    print(f"Wrote {output}, load it with calibratorCore.load_profile")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+import websockets
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "Sockets"))
+
+from enderTalker import CameraController
+from klipper_comms import KlipperComms
+from socket_communicator import PrinterConnection
+
+COMMAND = "G1 X100 Y100 F6000"
+
+
+def summarise(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "messages": len(latencies),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean()),
+        "msgs_per_s": len(latencies) / elapsed,
+    }
+
+
+def _timed(send: Callable[[], None], count: int) -> Dict[str, float]:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(count):
+        sent = time.perf_counter()
+        send()
+        latencies.append(time.perf_counter() - sent)
+    return summarise(latencies, time.perf_counter() - started)
+
+
+def _unix_path(directory: str, name: str) -> str:
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        os.unlink(path)
+    return path
+
+
+def bench_klipper_comms(directory: str, count: int) -> Dict[str, float]:
+    """Command datagram out, REQUEST back on the control stream.
+
+    The stand-in extension answers every command at once instead of on its
+    next reactor tick, so only the transport is measured.
+    """
+    command_path = _unix_path(directory, "command_socket.sock")
+    control_path = _unix_path(directory, "control_socket.sock")
+    comms = KlipperComms(command_socket_path=command_path, control_socket_path=control_path)
+    extension = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    extension.bind(command_path)
+
+    def message(text: str) -> None:
+        control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        control.connect(control_path)
+        control.send(text.encode())
+        control.close()
+
+    def serve() -> None:
+        message("START 1 0.000 0.000 0.000")
+        while True:
+            data, _ = extension.recvfrom(65536)
+            if data == b"DONE":
+                return
+            message("REQUEST 1 100.000 100.000 0.000")
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    comms.wait_for_start(5)
+
+    def send() -> None:
+        comms.sendCommand(COMMAND)
+        if not comms.wait_for_request(5):
+            raise TimeoutError("No REQUEST from the stand-in extension")
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = _timed(send, count)
+            comms.sendCommand("DONE")
+    finally:
+        thread.join(timeout=5)
+        extension.close()
+    return result
+
+
+def bench_printer_connection(directory: str, count: int) -> Dict[str, float]:
+    """workcell_controller's datagram loop, answered with REQUEST on accept."""
+    loop_path = _unix_path(directory, "camera_loop.sock")
+    ctrl_path = _unix_path(directory, "camera_ctrl.sock")
+    loop_srv = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    loop_srv.bind(loop_path)
+    ctrl_srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    ctrl_srv.bind(ctrl_path)
+    ctrl_srv.listen(1)
+
+    def serve() -> None:
+        while True:
+            data, _ = loop_srv.recvfrom(65536)
+            if data == b"DONE":
+                return
+            conn, _ = ctrl_srv.accept()
+            conn.sendall(b"REQUEST 1")
+            conn.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    connection = PrinterConnection(camera_loop_path=loop_path, camera_ctrl_path=ctrl_path)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = _timed(lambda: connection.send_command(COMMAND), count)
+            connection.send_command("DONE")
+    finally:
+        thread.join(timeout=5)
+        connection.camera_loop.close()
+        loop_srv.close()
+        ctrl_srv.close()
+    return result
+
+
+class FakeMoonraker:
+    """JSON-RPC websocket that acknowledges printer.gcode.script at once."""
+
+    def __init__(self) -> None:
+        self.port = None
+        self._ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        self._stop = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    async def _handler(self, websocket) -> None:
+        async for raw in websocket:
+            message = json.loads(raw)
+            replies = [
+                {"jsonrpc": "2.0", "id": item["id"], "result": "ok"}
+                for item in (message if isinstance(message, list) else [message])
+            ]
+            await websocket.send(
+                json.dumps(replies if isinstance(message, list) else replies[0])
+            )
+
+    async def _serve(self) -> None:
+        self._stop = asyncio.Event()
+        async with websockets.serve(self._handler, "127.0.0.1", 0) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            self._ready.set()
+            await self._stop.wait()
+
+    def _run(self) -> None:
+        self._loop.run_until_complete(self._serve())
+
+    def start(self) -> str:
+        self._thread.start()
+        self._ready.wait(5)
+        return f"ws://127.0.0.1:{self.port}/websocket"
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(timeout=5)
+
+
+def bench_moonraker(count: int) -> Dict[str, Dict[str, float]]:
+    """CameraController.send_gcode one at a time, and pipelined."""
+    server = FakeMoonraker()
+    uri = server.start()
+
+    async def run() -> Dict[str, Dict[str, float]]:
+        controller = CameraController(uri)
+        with contextlib.redirect_stdout(io.StringIO()):
+            await controller.connect()
+        try:
+            latencies = []
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(count):
+                    sent = time.perf_counter()
+                    await controller.send_gcode(COMMAND)
+                    latencies.append(time.perf_counter() - sent)
+            sequential = summarise(latencies, time.perf_counter() - started)
+
+            # Every request in flight at once, each timed until its own reply
+            started = time.perf_counter()
+
+            async def timed() -> float:
+                sent = time.perf_counter()
+                await controller.send_gcode_nowait(COMMAND)
+                return time.perf_counter() - sent
+
+            latencies = await asyncio.gather(*(timed() for _ in range(count)))
+            pipelined = summarise(latencies, time.perf_counter() - started)
+        finally:
+            with contextlib.redirect_stdout(io.StringIO()):
+                await controller.disconnect()
+        return {"moonraker": sequential, "moonraker_pipelined": pipelined}
+
+    try:
+        return asyncio.run(run())
+    finally:
+        server.close()
+
+
+def main() -> None:
+    # Usage: linkBenchmark.py [results.json] [messages]
+    output = Path(sys.argv[1] if len(sys.argv) > 1 else "link_benchmark.json")
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        results["klipper_comms"] = bench_klipper_comms(directory, count)
+        results["printer_connection"] = bench_printer_connection(directory, count)
+    results.update(bench_moonraker(count))
+    for name, result in results.items():
+        print(
+            f"{name:20s} p50 {result['p50_ms']:7.3f} ms  p99 {result['p99_ms']:7.3f} ms"
+            f"  {result['msgs_per_s']:9.0f} msgs/s"
+        )
+    with open(output, "w") as f:
+        json.dump(
+            {"created": time.time(), "command": COMMAND, "results": results},
+            f,
+            indent=2,
+        )
+    print(f"Wrote {len(results)} results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import itertools
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import websockets
+
+
+class MoonrakerClient:
+    """Pipelined Moonraker JSON-RPC client.
+
+    A single reader task owns the websocket. Responses are matched to the
+    future of the request that produced them and notifications are handed to
+    subscribers, so any number of requests can be in flight at once.
+    """
+
+    def __init__(
+        self,
+        uri: str = "ws://192.168.0.100:7125/websocket",
+        reconnect: bool = True,
+        reconnect_delay: float = 0.5,
+        max_reconnect_delay: float = 10.0,
+    ) -> None:
+        self.uri = uri
+        self.reconnect = reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.websocket = None
+        self.running = False
+        self._id_iter = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._subscribers: Dict[str, List[Callable[[Any], None]]] = defaultdict(list)
+        self._reconnect_hooks: List[Callable[[], Any]] = []
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connected: Optional[asyncio.Event] = None
+        self._closing = False
+
+    async def connect(self) -> bool:
+        """Open the websocket and start the reader task."""
+        if self._connected is None:
+            self._connected = asyncio.Event()
+        self._closing = False
+        # A second connect replaces the connection, one reader owns it
+        await self._stop_reader()
+        if self.websocket is not None:
+            await self.websocket.close()
+            self.websocket = None
+        try:
+            self.websocket = await websockets.connect(self.uri)
+        except Exception as exc:
+            print(f"Failed to connect: {exc}")
+            self.running = False
+            self.websocket = None
+            return False
+        self.running = True
+        self._connected.set()
+        self._reader_task = asyncio.ensure_future(self._reader())
+        print("Connected to Moonraker websocket - connection will stay open")
+        return True
+
+    async def disconnect(self) -> None:
+        """Stop the reader task and close the websocket."""
+        self._closing = True
+        self.running = False
+        await self._stop_reader()
+        if self.websocket is not None:
+            await self.websocket.close()
+        self.websocket = None
+        if self._connected is not None:
+            self._connected.clear()
+        self._fail_pending(ConnectionError("Connection closed"))
+        print("Connection closed")
+
+    async def _stop_reader(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader_task = None
+
+    def subscribe(self, method: str, callback: Callable[[Any], None]) -> None:
+        """Call ``callback(params)`` for every notification named ``method``."""
+        self._subscribers[method].append(callback)
+
+    def unsubscribe(self, method: str, callback: Callable[[Any], None]) -> None:
+        if callback in self._subscribers.get(method, []):
+            self._subscribers[method].remove(callback)
+
+    def on_reconnect(self, hook: Callable[[], Any]) -> None:
+        """Run ``hook`` (sync or async) each time the connection is re-opened."""
+        self._reconnect_hooks.append(hook)
+
+    def call_nowait(self, method: str, params: Optional[dict] = None) -> asyncio.Future:
+        """Send a request and return the future for its result without waiting."""
+        request_id, payload, future = self._make_request(method, params)
+        asyncio.ensure_future(self._send_payload(payload, [request_id]))
+        return future
+
+    async def call(
+        self, method: str, params: Optional[dict] = None, timeout: Optional[float] = None
+    ) -> Any:
+        """Send a request and wait for its result. Errors raise RuntimeError."""
+        request_id, payload, future = self._make_request(method, params)
+        await self._send_payload(payload, [request_id], timeout)
+        return await asyncio.wait_for(future, timeout)
+
+    async def call_batch(
+        self,
+        calls: Sequence[Tuple[str, Optional[dict]]],
+        timeout: Optional[float] = None,
+    ) -> List[Any]:
+        """Send several requests as one JSON-RPC batch.
+
+        Results come back in the order of ``calls``; a failed call is returned
+        as its RuntimeError rather than raised so the others are not lost.
+        """
+        requests = [self._make_request(method, params) for method, params in calls]
+        if not requests:
+            return []
+        await self._send_payload(
+            [payload for _, payload, _ in requests],
+            [request_id for request_id, _, _ in requests],
+            timeout,
+        )
+        return await asyncio.wait_for(
+            asyncio.gather(*(future for _, _, future in requests), return_exceptions=True),
+            timeout,
+        )
+
+    def _make_request(self, method: str, params: Optional[dict]):
+        request_id = next(self._id_iter)
+        payload = {"jsonrpc": "2.0", "method": method, "id": request_id}
+        if params is not None:
+            payload["params"] = params
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        return request_id, payload, future
+
+    async def _send_payload(
+        self, payload, request_ids: List[int], timeout: Optional[float] = None
+    ) -> None:
+        try:
+            if self._connected is None:
+                raise ConnectionError("WebSocket not connected")
+            if not self._connected.is_set():
+                if not self.reconnect or self._closing:
+                    raise ConnectionError("WebSocket not connected")
+                # While reconnecting, for no longer than the call would wait
+                await asyncio.wait_for(self._connected.wait(), timeout)
+            await self.websocket.send(json.dumps(payload))
+        except Exception as exc:
+            for request_id in request_ids:
+                future = self._pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_exception(exc)
+
+    async def _reader(self) -> None:
+        while not self._closing:
+            try:
+                async for raw_message in self.websocket:
+                    self._dispatch(raw_message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"Moonraker connection lost: {exc}")
+            if self._closing:
+                break
+            self.running = False
+            self._connected.clear()
+            self._fail_pending(ConnectionError("Moonraker connection lost"))
+            if not self.reconnect:
+                break
+            await self._reconnect()
+
+    async def _reconnect(self) -> None:
+        delay = self.reconnect_delay
+        while not self._closing:
+            await asyncio.sleep(delay)
+            try:
+                self.websocket = await websockets.connect(self.uri)
+            except Exception as exc:
+                print(f"Reconnect failed, retrying in {delay:.1f}s: {exc}")
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            self.running = True
+            self._connected.set()
+            print("Reconnected to Moonraker websocket")
+            for hook in self._reconnect_hooks:
+                result = hook()
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+            return
+
+    def _dispatch(self, raw_message) -> None:
+        try:
+            message = json.loads(raw_message)
+        except json.JSONDecodeError:
+            print(f"Received non-JSON message: {raw_message}")
+            return
+        for item in message if isinstance(message, list) else [message]:
+            if "id" in item and ("result" in item or "error" in item):
+                future = self._pending.pop(item["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in item:
+                    future.set_exception(RuntimeError(item["error"]))
+                else:
+                    future.set_result(item.get("result"))
+                continue
+            method = item.get("method")
+            for callback in list(self._subscribers.get(method, [])):
+                try:
+                    callback(item.get("params"))
+                except Exception as exc:
+                    print(f"Subscriber for {method} failed: {exc}")
+
+    def _fail_pending(self, exc: Exception) -> None:
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+
+if __name__ == "__main__":
+    print("This module is intended to be imported, not run directly.")
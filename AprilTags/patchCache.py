@@ -0,0 +1,167 @@
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patches (
+    tag_id INTEGER PRIMARY KEY,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    z REAL NOT NULL,
+    mm_per_px REAL NOT NULL,
+    png BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class Patch:
+    tag_id: int
+    x: float
+    y: float
+    z: float
+    mm_per_px: float
+    image: np.ndarray
+
+
+class PatchCache:
+    """Grayscale patches of the view over each calibrated waypoint.
+
+    Patches are kept as PNGs in the waypoint database (see waypointStore.py)
+    and the least recently used ones are evicted once the cache grows past
+    ``max_bytes``.
+    """
+
+    def __init__(
+        self, path: Union[str, Path], max_bytes: int = 16 * 1024 * 1024
+    ) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def put(
+        self,
+        tag_id: int,
+        image: np.ndarray,
+        x: float,
+        y: float,
+        z: float,
+        mm_per_px: float,
+    ) -> None:
+        ok, encoded = cv2.imencode(".png", image)
+        if not ok:
+            print(f"Unable to encode patch for tag {tag_id}")
+            return
+        data = encoded.tobytes()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO patches"
+                    " (tag_id, x, y, z, mm_per_px, png, size, used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (int(tag_id), x, y, z, mm_per_px, data, len(data), time.time()),
+                )
+                self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get(self, tag_id: int) -> Optional[Patch]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tag_id, x, y, z, mm_per_px, png FROM patches WHERE tag_id = ?",
+                (int(tag_id),),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE patches SET used = ? WHERE tag_id = ?",
+                (time.time(), int(tag_id)),
+            )
+        image = cv2.imdecode(
+            np.frombuffer(row[5], dtype=np.uint8), cv2.IMREAD_GRAYSCALE
+        )
+        return Patch(row[0], row[1], row[2], row[3], row[4], image)
+
+    def discard(self, tag_id: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM patches WHERE tag_id = ?", (int(tag_id),))
+
+    def _evict(self) -> None:
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM patches"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for tag_id, size in self._conn.execute(
+            "SELECT tag_id, size FROM patches ORDER BY used"
+        ).fetchall():
+            self._conn.execute("DELETE FROM patches WHERE tag_id = ?", (tag_id,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def center_patch(gray: np.ndarray, size: int) -> np.ndarray:
+    """Square crop of ``size`` px (or the whole short side) from the image centre."""
+    height, width = gray.shape
+    size = min(size, height, width)
+    top = (height - size) // 2
+    left = (width - size) // 2
+    return gray[top : top + size, left : left + size]
+
+
+def relocalise(
+    patch: np.ndarray, gray: np.ndarray, min_response: float = 0.2
+) -> Optional[Tuple[float, float, float]]:
+    """Where the patch's content moved to relative to the image centre.
+
+    Returns (dx, dy, score) in px, positive dx/dy meaning the content now sits
+    right of / below the centre, or None when neither method finds it.
+    Phase correlation of the centre crop handles small shifts; larger ones
+    fall back to a template match on half-resolution images.
+    """
+    crop = center_patch(gray, patch.shape[0])
+    if crop.shape == patch.shape:
+        window = cv2.createHanningWindow(patch.shape[::-1], cv2.CV_32F)
+        (dx, dy), response = cv2.phaseCorrelate(
+            np.float32(patch), np.float32(crop), window
+        )
+        if response >= min_response:
+            return dx, dy, response
+
+    small_patch = cv2.pyrDown(patch)
+    small_gray = cv2.pyrDown(gray)
+    if any(p > g for p, g in zip(small_patch.shape, small_gray.shape)):
+        return None
+    scores = cv2.matchTemplate(small_gray, small_patch, cv2.TM_CCOEFF_NORMED)
+    _, score, _, (left, top) = cv2.minMaxLoc(scores)
+    if score < 0.5:
+        return None
+    height, width = gray.shape
+    dx = (left * 2 + patch.shape[1] / 2) - width / 2
+    dy = (top * 2 + patch.shape[0] / 2) - height / 2
+    return dx, dy, score
+
+
+if __name__ == "__main__":
+    print("This module is intended to be imported, not run directly.")
@@ -0,0 +1,313 @@
+import asyncio
+import os
+import queue
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "Sockets"))
+
+from commandAssembler import expected_target
+
+Position = Tuple[float, float, float]
+
+
+class PrinterLink(ABC):
+    """How G-code gets to the printer.
+
+    The calibrator only talks to this interface so the same control logic can
+    run over any transport. ``send`` queues a batch of lines as one script,
+    ``wait_idle`` blocks until the printer is ready for the next batch and
+    ``position`` returns the toolhead's XYZ (None when it is not known).
+    ``mode`` is "calibrate" or "verify" for the session last returned by
+    ``next_session``.
+    """
+
+    def __init__(self) -> None:
+        self._sessions: "queue.Queue[Tuple[int, str]]" = queue.Queue()
+        self.mode = "calibrate"
+
+    @abstractmethod
+    def send(self, batch: Sequence[str]) -> None:
+        ...
+
+    @abstractmethod
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        ...
+
+    @abstractmethod
+    def position(self) -> Optional[Position]:
+        ...
+
+    def start_session(self, tag_id: int, mode: str = "calibrate") -> None:
+        """Queue a calibration (or verification) request for ``tag_id``."""
+        self._sessions.put((tag_id, mode))
+
+    def next_session(self, timeout: Optional[float] = None) -> Optional[int]:
+        """Block until a calibration is requested and return its tag id."""
+        try:
+            tag_id, self.mode = self._sessions.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return tag_id
+
+    def respond(self, message: str) -> None:
+        """Show ``message`` in the printer's console where the link can."""
+        print(message)
+
+    def finish(self) -> None:
+        """Tell the printer side that the current calibration is over."""
+
+    def close(self) -> None:
+        """Release the transport."""
+
+
+class SocketLink(PrinterLink):
+    """Unix sockets to workcell_controllerV2 through KlipperComms."""
+
+    def __init__(self, comms=None) -> None:
+        super().__init__()
+        if comms is None:
+            from klipper_comms import KlipperComms
+
+            comms = KlipperComms()
+        self.comms = comms
+
+    def send(self, batch: Sequence[str]) -> None:
+        script = "\n".join(line for line in batch if line)
+        if script:
+            self.comms.sendCommand(script)
+
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        # The extension only sends REQUEST once the toolhead is idle
+        return self.comms.wait_for_request(timeout)
+
+    def position(self) -> Optional[Position]:
+        # Until the next REQUEST arrives the last sent command has not run yet,
+        # so the reported position would be stale
+        if not self.comms.get_needCommand():
+            return None
+        return self.comms.get_position()
+
+    def next_session(self, timeout: Optional[float] = None) -> Optional[int]:
+        if not self.comms.wait_for_start(timeout):
+            return None
+        self.mode = self.comms.get_mode()
+        return self.comms.get_tag_id()
+
+    def respond(self, message: str) -> None:
+        # The extension shows INFO through gcode.respond_info. RESPOND would
+        # need [respond] in printer.cfg and fail inside the extension's timer.
+        self.comms.sendCommand(f"INFO {message}")
+
+    def finish(self) -> None:
+        self.comms.sendCommand("DONE")
+
+
+class MoonrakerLink(PrinterLink):
+    """Moonraker websocket, gated on the live toolhead subscription.
+
+    The CameraController runs on its own event loop in a background thread so
+    its reader task keeps consuming status updates between calls.
+    """
+
+    def __init__(self, controller=None, uri: Optional[str] = None) -> None:
+        super().__init__()
+        if controller is None:
+            from enderTalker import CameraController
+
+            controller = CameraController(uri) if uri else CameraController()
+        self.controller = controller
+        self._absolute = True
+        self._target: Dict[str, float] = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        if not self._run(self.controller.connect()):
+            raise ConnectionError(f"Unable to connect to {self.controller.uri}")
+        self._run(self.controller.subscribe_toolhead())
+
+    def _run(self, coro, timeout: Optional[float] = None):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def send(self, batch: Sequence[str]) -> None:
+        script = "\n".join(line for line in batch if line)
+        if script:
+            self._track_target(script)
+            self._run(self.controller.send_gcode(script))
+
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        # Waiting for the commanded position to reach the last target keeps a
+        # stale "idle" snapshot from before the move from ending the wait early
+        try:
+            self._run(self.controller.wait_idle(self._target or None, timeout=timeout))
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _track_target(self, script: str) -> None:
+        snapshot = self.controller.toolhead
+        self._target, self._absolute = expected_target(
+            script,
+            self._absolute,
+            self._target,
+            None if snapshot is None else snapshot.gcode_position,
+        )
+
+    def position(self) -> Optional[Position]:
+        # In G-code coordinates, the calibrator's moves are written in them
+        snapshot = self.controller.toolhead
+        return None if snapshot is None else snapshot.gcode_position
+
+    def respond(self, message: str) -> None:
+        self.send([f'RESPOND MSG="[Workcell Controller] {message}"'])
+
+    def next_session(self, timeout: Optional[float] = None) -> Optional[int]:
+        tag_id = super().next_session(timeout)
+        # The last session's target would make wait_idle wait for a position
+        # the toolhead may never return to
+        self._target = {}
+        return tag_id
+
+    def close(self) -> None:
+        self._run(self.controller.disconnect())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class RemoteMethodLink(MoonrakerLink):
+    """Moonraker websocket that also receives calibration requests.
+
+    The calibrator registers the ``apriltags_start`` remote method and the
+    APRILTAGS macro in Sockets/apriltags_remote.cfg calls it through
+    ``action_call_remote_method``. Commands go back over the same websocket,
+    so no /tmp sockets are needed and the calibrator can run on another host.
+    """
+
+    METHOD_NAME = "apriltags_start"
+
+    def __init__(self, controller=None, uri: Optional[str] = None) -> None:
+        super().__init__(controller, uri)
+        self._tag_id: Optional[int] = None
+        self.controller.subscribe(self.METHOD_NAME, self._on_start)
+        self.controller.on_reconnect(self._register)
+        self._run(self._register())
+
+    async def _register(self) -> None:
+        await self.controller.call(
+            "server.connection.identify",
+            {
+                "client_name": "apriltags_calibrator",
+                "version": "1.0",
+                "type": "agent",
+                "url": "https://github.com/VT-CRO/Workcell-CV",
+            },
+        )
+        await self.controller.call(
+            "connection.register_remote_method", {"method_name": self.METHOD_NAME}
+        )
+
+    def _on_start(self, params) -> None:
+        tag_id = (params or {}).get("tag_id")
+        if tag_id is None:
+            print("Remote calibration request without a tag_id")
+            return
+        self.start_session(int(tag_id), (params or {}).get("mode", "calibrate"))
+
+    def next_session(self, timeout: Optional[float] = None) -> Optional[int]:
+        self._tag_id = super().next_session(timeout)
+        return self._tag_id
+
+    def finish(self) -> None:
+        position = self.position()
+        where = "" if position is None else " at {:.3f} {:.3f} {:.3f}".format(*position)
+        self.respond(f"Detected tag {self._tag_id}{where}")
+        self._tag_id = None
+
+
+class DatagramLink(PrinterLink):
+    """camera_loop / camera_ctrl datagram pair used by workcell_controller.
+
+    PrinterConnection.send_command already blocks until the next REQUEST, and
+    the protocol carries no position.
+    """
+
+    def __init__(self, connection=None) -> None:
+        super().__init__()
+        if connection is None:
+            from socket_communicator import PrinterConnection
+
+            connection = PrinterConnection()
+        self.connection = connection
+
+    def send(self, batch: Sequence[str]) -> None:
+        script = "\n".join(line for line in batch if line)
+        if script:
+            self.connection.send_command(script)
+
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        return True
+
+    def position(self) -> Optional[Position]:
+        return None
+
+    def next_session(self, timeout: Optional[float] = None) -> Optional[int]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            tag_id = self.connection.wait_for_command()
+            if tag_id is not None:
+                self.mode = "calibrate"
+                return int(tag_id)
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(0.1)
+
+    def finish(self) -> None:
+        self.connection.send_command("DONE")
+
+
+class InProcessLink(PrinterLink):
+    """Direct calls into a printer living in the same process.
+
+    ``run_script`` runs a G-code script (for example Klipper's
+    ``gcode.run_script`` or a simulator), ``get_position`` returns the
+    toolhead position and ``is_busy`` reports whether moves are still running.
+    """
+
+    def __init__(
+        self,
+        run_script: Callable[[str], None],
+        get_position: Callable[[], Sequence[float]],
+        is_busy: Optional[Callable[[], bool]] = None,
+        poll_interval: float = 0.01,
+    ) -> None:
+        super().__init__()
+        self.run_script = run_script
+        self.get_position = get_position
+        self.is_busy = is_busy
+        self.poll_interval = poll_interval
+
+    def send(self, batch: Sequence[str]) -> None:
+        script = "\n".join(line for line in batch if line)
+        if script:
+            self.run_script(script)
+
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        if self.is_busy is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while self.is_busy():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def position(self) -> Optional[Position]:
+        position = self.get_position()
+        return None if position is None else tuple(position[:3])
+
+
+if __name__ == "__main__":
+    print("This module is intended to be imported, not run directly.")
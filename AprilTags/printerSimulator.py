@@ -0,0 +1,655 @@
+import errno
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from commandAssembler import MotionLimits
+
+Position = Tuple[float, float, float]
+
+
+@dataclass
+class SimTag:
+    """A tag36h11 tag lying on the virtual bed, centred on (x, y) in mm."""
+
+    tag_id: int
+    x: float
+    y: float
+    size_mm: float = 20.0  # side of the black square, as tag_size_mm
+    angle: float = 0.0  # degrees, counter-clockwise seen from above
+
+
+@dataclass
+class CameraModel:
+    """Downward camera on the toolhead, centred over the commanded XY.
+
+    The lens sits ``lens_z_offset`` mm above the toolhead Z, so the bed is
+    Z + lens_z_offset away, the same model the calibrator's stage planner
+    uses. ``tilt_deg`` tips the camera about its x and y axes for some
+    perspective, ``exposure`` turns motion during a grab into blur.
+    """
+
+    width: int = 640
+    height: int = 480
+    focal_px: float = 600.0
+    lens_z_offset: float = 70.0
+    tilt_deg: Tuple[float, float] = (0.5, 0.3)
+    blur_sigma: float = 0.8
+    noise_std: float = 3.0
+    exposure: float = 0.02
+    jpeg_quality: int = 90
+
+
+class SimClock:
+    """Simulated time for runs that should not wait on the wall clock.
+
+    Pass it as ``clock`` and its ``sleep`` wherever time.monotonic and
+    time.sleep would be used.
+    """
+
+    def __init__(self, start: float = 0.0) -> None:
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += max(0.0, seconds)
+
+    def advance_to(self, t: float) -> None:
+        self.now = max(self.now, t)
+
+
+@dataclass
+class Move:
+    start: Position
+    end: Position
+    t0: float
+    duration: float
+    velocity: float
+    accel: float
+
+    def position_at(self, t: float) -> Position:
+        if self.duration <= 0 or t >= self.t0 + self.duration:
+            return self.end
+        if t <= self.t0:
+            return self.start
+        distance = math.dist(self.start, self.end)
+        covered = _trapezoid_distance(t - self.t0, distance, self.velocity, self.accel)
+        fraction = covered / distance
+        return tuple(a + (b - a) * fraction for a, b in zip(self.start, self.end))
+
+
+def _trapezoid_distance(
+    t: float, distance: float, velocity: float, accel: float
+) -> float:
+    # Distance covered t seconds into a rest to rest move
+    if distance <= velocity * velocity / accel:
+        velocity = math.sqrt(distance * accel)
+    ramp = velocity / accel
+    ramp_distance = velocity * ramp / 2
+    cruise = (distance - 2 * ramp_distance) / velocity
+    if t < ramp:
+        return accel * t * t / 2
+    if t < ramp + cruise:
+        return ramp_distance + velocity * (t - ramp)
+    left = max(0.0, 2 * ramp + cruise - t)
+    return distance - accel * left * left / 2
+
+
+class VirtualGantry:
+    """Toolhead that runs G-code scripts against a clock.
+
+    Moves are queued back to back and timed with the same trapezoidal model
+    as the command assembler's estimates, taken from ``limits``. The carriage
+    lags the commanded position by half of ``backlash`` (mm per axis) in
+    the direction of travel, so approaching a point from either side lands
+    ``backlash`` apart, like a loose belt.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[MotionLimits] = None,
+        backlash: Position = (0.05, 0.05, 0.0),
+        position: Position = (0.0, 0.0, 50.0),
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.limits = limits if limits is not None else MotionLimits()
+        self.backlash = backlash
+        self.clock = clock
+        self.commanded = tuple(float(value) for value in position)
+        self.absolute = True
+        self.feedrate: Optional[float] = None
+        self.accel: Optional[float] = None
+        # SAVE_GCODE_STATE name -> (absolute, feedrate)
+        self._saved_states: Dict[str, Tuple[bool, Optional[float]]] = {}
+        self._direction = [0, 0, 0]
+        self._moves: List[Move] = []
+        self.busy_until = clock()
+        self.moves = 0
+        self.scripts = 0
+        self.messages: List[str] = []
+        self._lock = threading.Lock()
+
+    def execute(self, script: str) -> float:
+        """Queue every line of ``script`` and return when the last move ends."""
+        with self._lock:
+            self.scripts += 1
+            for line in script.splitlines():
+                self._execute_line(line.strip())
+            return self.busy_until
+
+    def _execute_line(self, line: str) -> None:
+        words = line.split()
+        if not words:
+            return
+        code = words[0].upper()
+        if code == "G90":
+            self.absolute = True
+        elif code == "G91":
+            self.absolute = False
+        elif code == "G28":
+            self._queue_move((0.0, 0.0, 0.0))
+        elif code in ("G0", "G1"):
+            target = list(self.commanded)
+            for word in words[1:]:
+                axis, value = word[0].upper(), float(word[1:])
+                if axis == "F":
+                    self.feedrate = value
+                elif axis in "XYZ":
+                    index = "XYZ".index(axis)
+                    target[index] = value if self.absolute else target[index] + value
+            self._queue_move(tuple(target))
+        elif code == "SET_VELOCITY_LIMIT":
+            for word in words[1:]:
+                key, _, value = word.partition("=")
+                if key.upper() == "ACCEL":
+                    self.accel = float(value)
+        elif code in ("SAVE_GCODE_STATE", "RESTORE_GCODE_STATE"):
+            name = "default"
+            for word in words[1:]:
+                key, _, value = word.partition("=")
+                if key.upper() == "NAME":
+                    name = value
+            if code == "SAVE_GCODE_STATE":
+                self._saved_states[name] = (self.absolute, self.feedrate)
+            elif name in self._saved_states:
+                self.absolute, self.feedrate = self._saved_states[name]
+        elif code == "RESPOND":
+            self.messages.append(line)
+        # Anything else (M400, macros) takes no time here
+
+    def _queue_move(self, target: Position) -> None:
+        start = self.commanded
+        deltas = [b - a for a, b in zip(start, target)]
+        distance = math.hypot(*deltas)
+        if distance <= 0:
+            return
+        dz = deltas[2]
+        velocity, accel = self.limits.move_profile(distance, dz, self.feedrate, self.accel)
+        duration = self.limits.move_duration(distance, dz, self.feedrate, self.accel)
+        t0 = max(self.clock(), self.busy_until)
+        carriage = self._carriage(start)
+        for index, delta in enumerate(deltas):
+            if delta:
+                self._direction[index] = 1 if delta > 0 else -1
+        self.commanded = target
+        self._moves.append(
+            Move(carriage, self._carriage(target), t0, duration, velocity, accel)
+        )
+        self.busy_until = t0 + duration
+        self.moves += 1
+        # Old moves are only needed while a frame could still fall in them
+        now = self.clock()
+        self._moves = [
+            move for move in self._moves if move.t0 + move.duration >= now - 1
+        ]
+
+    def _carriage(self, commanded: Position) -> Position:
+        return tuple(
+            value - direction * lash / 2
+            for value, direction, lash in zip(commanded, self._direction, self.backlash)
+        )
+
+    def is_busy(self, t: Optional[float] = None) -> bool:
+        return (self.clock() if t is None else t) < self.busy_until
+
+    def actual_at(self, t: Optional[float] = None) -> Position:
+        """Where the carriage physically is at ``t`` (default now)."""
+        t = self.clock() if t is None else t
+        with self._lock:
+            for move in self._moves:
+                if move.t0 <= t < move.t0 + move.duration:
+                    return move.position_at(t)
+            return self._carriage(self.commanded)
+
+    def velocity_at(self, t: Optional[float] = None, dt: float = 0.005) -> Position:
+        t = self.clock() if t is None else t
+        before, after = self.actual_at(t - dt), self.actual_at(t + dt)
+        return tuple((b - a) / (2 * dt) for a, b in zip(before, after))
+
+
+class BedScene:
+    """Renders what the toolhead camera sees of a bed with tags on it."""
+
+    def __init__(
+        self,
+        tags: List[SimTag],
+        camera: Optional[CameraModel] = None,
+        bed_size: Tuple[float, float] = (235.0, 235.0),
+        px_per_mm: float = 8.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.tags = {tag.tag_id: tag for tag in tags}
+        self.camera = camera if camera is not None else CameraModel()
+        self.bed_size = bed_size
+        self.px_per_mm = px_per_mm
+        self._rng = np.random.default_rng(seed)
+        self._texture = self._draw_bed()
+
+    def _draw_bed(self) -> np.ndarray:
+        width = int(self.bed_size[0] * self.px_per_mm)
+        height = int(self.bed_size[1] * self.px_per_mm)
+        # Texture row v is bed Y = v / px_per_mm, the homography flips it
+        bed = np.full((height, width), 235, dtype=np.uint8)
+        dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_APRILTAG_36h11)
+        for tag in self.tags.values():
+            # The generated marker is the black square, pad it with a two
+            # cell white quiet zone
+            side = int(round(tag.size_mm * self.px_per_mm))
+            marker = cv2.aruco.generateImageMarker(dictionary, tag.tag_id, side)
+            # Printed tags read correctly from above with image up as +Y, so
+            # flip the marker into texture rows
+            marker = cv2.flip(marker, 0)
+            pad = side // 4
+            marker = cv2.copyMakeBorder(
+                marker, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=255
+            )
+            # Pixel centres, so the square's edges land on tag_corners
+            centre = ((marker.shape[1] - 1) / 2, (marker.shape[0] - 1) / 2)
+            rotation = cv2.getRotationMatrix2D(centre, -tag.angle, 1.0)
+            rotation[0, 2] += tag.x * self.px_per_mm - centre[0]
+            rotation[1, 2] += tag.y * self.px_per_mm - centre[1]
+            mask = cv2.warpAffine(
+                np.full(marker.shape, 255, dtype=np.uint8), rotation, (width, height)
+            )
+            warped = cv2.warpAffine(marker, rotation, (width, height))
+            bed[mask > 0] = warped[mask > 0]
+        return bed
+
+    def homography(self, position: Position) -> np.ndarray:
+        """Bed mm (x, y, 1) to image pixel indices for a camera at ``position``.
+
+        The optical axis passes through pixel edge coordinate (width / 2,
+        height / 2), the centre the calibrator steers to.
+        """
+        camera = self.camera
+        x, y, z = position
+        # Camera x along bed +X, camera y along bed -Y, looking down
+        rotation = np.array([[1.0, 0, 0], [0, -1.0, 0], [0, 0, -1.0]])
+        tilt_x, tilt_y = (math.radians(value) for value in camera.tilt_deg)
+        tilt = cv2.Rodrigues(np.array([tilt_x, tilt_y, 0.0]))[0]
+        rotation = tilt @ rotation
+        centre = np.array([x, y, z + camera.lens_z_offset])
+        intrinsics = np.array(
+            [
+                [camera.focal_px, 0, (camera.width - 1) / 2],
+                [0, camera.focal_px, (camera.height - 1) / 2],
+                [0, 0, 1],
+            ]
+        )
+        extrinsics = np.column_stack(
+            (rotation[:, 0], rotation[:, 1], -rotation @ centre)
+        )
+        return intrinsics @ extrinsics
+
+    def view_centre(self, position: Position) -> Tuple[float, float]:
+        """Bed mm under the image centre, where a centred tag would sit."""
+        camera = self.camera
+        centre = np.array([[[(camera.width - 1) / 2, (camera.height - 1) / 2]]])
+        x, y = cv2.perspectiveTransform(
+            centre, np.linalg.inv(self.homography(position))
+        ).reshape(2)
+        return float(x), float(y)
+
+    def tag_corners(self, tag: SimTag) -> np.ndarray:
+        """Bed mm corners of the black square, (4, 2)."""
+        half = tag.size_mm / 2
+        angle = math.radians(tag.angle)
+        cos, sin = math.cos(angle), math.sin(angle)
+        square = np.array([(-half, -half), (half, -half), (half, half), (-half, half)])
+        return square @ np.array([[cos, sin], [-sin, cos]]) + (tag.x, tag.y)
+
+    def ground_truth(self, position: Position) -> Dict[int, np.ndarray]:
+        """Image corners of every tag fully in view from ``position``.
+
+        In pixel edge coordinates, the convention pupil_apriltags reports in.
+        """
+        homography = self.homography(position)
+        truth = {}
+        for tag_id, tag in self.tags.items():
+            corners = cv2.perspectiveTransform(
+                self.tag_corners(tag).reshape(-1, 1, 2), homography
+            ).reshape(-1, 2) + 0.5
+            inside = (
+                (corners[:, 0] >= 0)
+                & (corners[:, 0] < self.camera.width)
+                & (corners[:, 1] >= 0)
+                & (corners[:, 1] < self.camera.height)
+            )
+            if inside.all():
+                truth[tag_id] = corners
+        return truth
+
+    def render(
+        self, position: Position, velocity: Position = (0.0, 0.0, 0.0)
+    ) -> np.ndarray:
+        """BGR frame from ``position``, smeared by ``velocity`` (mm/s)."""
+        camera = self.camera
+        homography = self.homography(position)
+        scale = np.diag([1 / self.px_per_mm, 1 / self.px_per_mm, 1])
+        gray = cv2.warpPerspective(
+            self._texture,
+            homography @ scale,
+            (camera.width, camera.height),
+            flags=cv2.INTER_AREA,
+            borderValue=90,
+        )
+        # Motion blur along the travel seen during the exposure
+        mm_per_px = (position[2] + camera.lens_z_offset) / camera.focal_px
+        streak = np.array(velocity[:2]) * camera.exposure / mm_per_px
+        length = int(round(math.hypot(*streak)))
+        if length > 1:
+            kernel = np.zeros((length, length), dtype=np.float32)
+            direction = streak / np.linalg.norm(streak)
+            centre = (length - 1) / 2
+            end = direction * centre * np.array([1, -1])
+            cv2.line(
+                kernel,
+                (int(round(centre - end[0])), int(round(centre - end[1]))),
+                (int(round(centre + end[0])), int(round(centre + end[1]))),
+                1.0,
+            )
+            gray = cv2.filter2D(gray, -1, kernel / kernel.sum())
+        if camera.blur_sigma > 0:
+            gray = cv2.GaussianBlur(gray, (0, 0), camera.blur_sigma)
+        if camera.noise_std > 0:
+            noise = self._rng.normal(0, camera.noise_std, gray.shape)
+            gray = np.clip(gray + noise, 0, 255).astype(np.uint8)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+@dataclass
+class SessionReport:
+    tag_id: int
+    mode: str
+    scripts: int = 0
+    moves: int = 0
+    wall_time: float = 0.0
+    final_position: Optional[Position] = None
+    error_mm: Optional[float] = None
+    messages: List[str] = field(default_factory=list)
+
+
+class SimulatedExtension:
+    """Stands in for workcell_controllerV2 on the calibrator's Unix sockets.
+
+    Speaks the same protocol: START/VERIFY then REQUEST with the commanded
+    position on the control socket once each command's moves have finished,
+    and runs the scripts read from the command datagram socket. INFO
+    messages are kept in the gantry's ``messages`` and DONE ends the session.
+    """
+
+    def __init__(
+        self,
+        gantry: VirtualGantry,
+        scene: BedScene,
+        command_socket_path: str = "/tmp/command_socket.sock",
+        control_socket_path: str = "/tmp/control_socket.sock",
+        idle_margin: float = 0.05,
+    ) -> None:
+        self.gantry = gantry
+        self.scene = scene
+        self.command_socket_path = command_socket_path
+        self.control_socket_path = control_socket_path
+        self.idle_margin = idle_margin
+
+    def _message(self, kind: str, tag_id: int) -> None:
+        x, y, z = self.gantry.commanded
+        control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            control.connect(self.control_socket_path)
+            control.send(f"{kind} {tag_id} {x:.3f} {y:.3f} {z:.3f}".encode())
+        finally:
+            control.close()
+
+    def _drain(self, command_socket: socket.socket) -> Optional[str]:
+        try:
+            data, _ = command_socket.recvfrom(65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            raise
+        return data.decode()
+
+    def run_session(
+        self, tag_id: int, mode: str = "calibrate", timeout: float = 600.0
+    ) -> SessionReport:
+        """APRILTAGS (or APRILTAGS_VERIFY) for ``tag_id``, until DONE."""
+        report = SessionReport(tag_id, mode)
+        command_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        os.makedirs(os.path.dirname(self.command_socket_path), exist_ok=True)
+        if os.path.exists(self.command_socket_path):
+            os.unlink(self.command_socket_path)
+        command_socket.bind(self.command_socket_path)
+        command_socket.setblocking(False)
+        scripts, moves = self.gantry.scripts, self.gantry.moves
+        messages = len(self.gantry.messages)
+        started = time.monotonic()
+        # As in workcell_controllerV2, one REQUEST per command, once it has run
+        request_when_idle = False
+        try:
+            self._message("VERIFY" if mode == "verify" else "START", tag_id)
+            while time.monotonic() - started < timeout:
+                idle_in = self.gantry.busy_until + self.idle_margin - self.gantry.clock()
+                if idle_in > 0:
+                    time.sleep(min(0.5, idle_in))
+                    continue
+                if request_when_idle:
+                    self._message("REQUEST", tag_id)
+                    request_when_idle = False
+                command = self._drain(command_socket)
+                if command is None:
+                    time.sleep(0.05)
+                    continue
+                if command == "DONE":
+                    break
+                if command.startswith("INFO "):
+                    self.gantry.messages.append(command)
+                else:
+                    self.gantry.execute(command)
+                request_when_idle = True
+            else:
+                print(f"Tag {tag_id}: no DONE after {timeout:.0f} s")
+        finally:
+            command_socket.close()
+        report.wall_time = time.monotonic() - started
+        report.scripts = self.gantry.scripts - scripts
+        report.moves = self.gantry.moves - moves
+        report.messages = self.gantry.messages[messages:]
+        report.final_position = self.gantry.actual_at()
+        tag = self.scene.tags.get(tag_id)
+        if tag is not None:
+            # Against the point the camera centres on, so tilt is not counted
+            x, y = self.scene.view_centre(report.final_position)
+            report.error_mm = math.hypot(x - tag.x, y - tag.y)
+        return report
+
+
+class SnapshotServer:
+    """The webcam endpoints the calibrator reads, rendered from the gantry.
+
+    ``?action=snapshot`` returns one JPEG and ``?action=stream`` an MJPEG
+    stream, on any path, like mjpg-streamer behind Moonraker's /webcam/.
+    """
+
+    def __init__(
+        self,
+        gantry: VirtualGantry,
+        scene: BedScene,
+        host: str = "127.0.0.1",
+        port: int = 80,
+        stream_fps: float = 15.0,
+    ) -> None:
+        self.gantry = gantry
+        self.scene = scene
+        self.stream_fps = stream_fps
+        self.frames = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                if query.get("action", ["snapshot"])[0] == "stream":
+                    server._stream(self)
+                else:
+                    server._snapshot(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def close(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/webcam/?action=snapshot"
+
+    def grab(self) -> bytes:
+        # Halfway through the exposure, wherever the carriage is by then
+        t = self.gantry.clock() + self.scene.camera.exposure / 2
+        frame = self.scene.render(self.gantry.actual_at(t), self.gantry.velocity_at(t))
+        self.frames += 1
+        ok, encoded = cv2.imencode(
+            ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.scene.camera.jpeg_quality]
+        )
+        return encoded.tobytes()
+
+    def _snapshot(self, handler: BaseHTTPRequestHandler) -> None:
+        data = self.grab()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "image/jpeg")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _stream(self, handler: BaseHTTPRequestHandler) -> None:
+        handler.send_response(200)
+        handler.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        handler.end_headers()
+        try:
+            while True:
+                data = self.grab()
+                handler.wfile.write(
+                    b"--frame\r\nContent-Type: image/jpeg\r\n"
+                    + f"Content-Length: {len(data)}\r\n\r\n".encode()
+                    + data
+                    + b"\r\n"
+                )
+                time.sleep(1 / self.stream_fps)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def load_scene(path: Optional[Path]) -> dict:
+    """Scene settings from JSON, every key optional.
+
+    {"tags": [{"tag_id": 3, "x": 120, "y": 107.5}], "camera": {...},
+     "gantry": {"backlash": [0.05, 0.05, 0], "position": [0, 0, 50],
+     "limits": {...}}, "port": 80, "socket_dir": "/tmp", "seed": 0}
+    """
+    if path is None:
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def build(scene: dict) -> Tuple[VirtualGantry, BedScene]:
+    tags = [SimTag(**entry) for entry in scene.get("tags", [])] or [
+        SimTag(3, 120.0, 107.5),
+        SimTag(5, 60.0, 40.0),
+        SimTag(7, 180.0, 170.0, angle=15.0),
+    ]
+    camera = scene.get("camera", {})
+    if "tilt_deg" in camera:
+        camera["tilt_deg"] = tuple(camera["tilt_deg"])
+    gantry_settings = scene.get("gantry", {})
+    gantry = VirtualGantry(
+        limits=MotionLimits(**gantry_settings.get("limits", {})),
+        backlash=tuple(gantry_settings.get("backlash", (0.05, 0.05, 0.0))),
+        position=tuple(gantry_settings.get("position", (0.0, 0.0, 50.0))),
+    )
+    bed = BedScene(tags, CameraModel(**camera), seed=scene.get("seed"))
+    return gantry, bed
+
+
+def main() -> None:
+    # Usage: printerSimulator.py [scene.json] [tag_id ...]
+    # Run the calibrator (e.g. AndysAutoCalibrator-Socket.py) alongside; the
+    # simulator plays the Klipper extension and the webcam, then reports.
+    args = sys.argv[1:]
+    path = Path(args.pop(0)) if args and args[0].endswith(".json") else None
+    scene = load_scene(path)
+    gantry, bed = build(scene)
+    socket_dir = scene.get("socket_dir", "/tmp")
+    extension = SimulatedExtension(
+        gantry,
+        bed,
+        command_socket_path=os.path.join(socket_dir, "command_socket.sock"),
+        control_socket_path=os.path.join(socket_dir, "control_socket.sock"),
+    )
+    server = SnapshotServer(gantry, bed, port=scene.get("port", 80))
+    server.start()
+    print(f"Serving frames at {server.url}")
+    while not os.path.exists(extension.control_socket_path):
+        print("Waiting for the calibrator's control socket")
+        time.sleep(1)
+
+    reports = []
+    try:
+        for tag_id in [int(tag_id) for tag_id in args] or list(bed.tags):
+            report = extension.run_session(tag_id)
+            error = "n/a" if report.error_mm is None else f"{report.error_mm:.3f} mm"
+            print(
+                f"Tag {tag_id}: {report.moves} moves in {report.scripts} scripts,"
+                f" {report.wall_time:.1f} s, error {error}"
+            )
+            reports.append(report)
+    finally:
+        server.close()
+    print(json.dumps([asdict(report) for report in reports], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+from commandAssembler import MOTION_PROFILES, CommandAssembler
+
+
+def test_feedrate_change_flushes_the_pending_move():
+    assembler = CommandAssembler()
+    assembler.begin()
+    assembler.set_absolute()
+    assembler.use_profile(MOTION_PROFILES["travel"])
+    assembler.set_x(100)
+    assembler.use_profile(MOTION_PROFILES["descent"])
+    assembler.zoom_in(10)
+    assert assembler.flush() == ["G90", "G1 X100 F6000", "G1 Z10 F300"]
+
+
+def test_moves_at_one_feedrate_still_merge():
+    assembler = CommandAssembler()
+    assembler.begin()
+    assembler.set_absolute()
+    assembler.use_profile(MOTION_PROFILES["descent"])
+    assembler.set_x(100)
+    assembler.use_profile(MOTION_PROFILES["descent"])
+    assembler.set_y(50)
+    assembler.zoom_in(10)
+    assert assembler.flush() == ["G90", "G1 X100 Y50 Z10 F300"]
@@ -0,0 +1,226 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS waypoints (
+    tag_id INTEGER PRIMARY KEY,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    z REAL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tag_id INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    z REAL,
+    iterations INTEGER,
+    duration REAL,
+    kind TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_tag ON history (tag_id, created);
+CREATE TABLE IF NOT EXISTS estimates (
+    tag_id INTEGER PRIMARY KEY,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    weight REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class Waypoint:
+    tag_id: int
+    x: float
+    y: float
+    z: Optional[float]
+    updated: float
+
+
+@dataclass
+class Estimate:
+    tag_id: int
+    x: float
+    y: float
+    weight: float
+    updated: float
+
+
+@dataclass
+class HistoryEntry:
+    tag_id: int
+    x: float
+    y: float
+    z: Optional[float]
+    iterations: Optional[int]
+    duration: Optional[float]
+    kind: str
+    created: float
+
+
+class WaypointStore:
+    """Calibrated waypoints in SQLite.
+
+    WAL mode lets the Klipper side or dashboards read while a calibrator
+    writes, each update is a single transaction, and every result is also
+    appended to ``history`` with a timestamp. The first time a store is
+    opened it imports the old waypoints.json / waypoints.txt if one is given.
+
+    Coarse positions of tags seen in passing are kept apart from the
+    waypoints in ``estimates``, as a weighted mean of the sightings.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        legacy_path: Optional[Union[str, Path]] = None,
+        max_estimate_weight: float = 20.0,
+    ) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Caps how much past sightings outweigh a new one, so a moved tag's
+        # estimate follows it
+        self.max_estimate_weight = max_estimate_weight
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        if legacy_path is not None and not self.all():
+            self.import_legacy(legacy_path)
+
+    def get(self, tag_id: int) -> Optional[Waypoint]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tag_id, x, y, z, updated FROM waypoints WHERE tag_id = ?",
+                (int(tag_id),),
+            ).fetchone()
+        return None if row is None else Waypoint(*row)
+
+    def all(self) -> Dict[int, Waypoint]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT tag_id, x, y, z, updated FROM waypoints"
+            ).fetchall()
+        return {row[0]: Waypoint(*row) for row in rows}
+
+    def record(
+        self,
+        tag_id: int,
+        x: float,
+        y: float,
+        z: Optional[float] = None,
+        iterations: Optional[int] = None,
+        duration: Optional[float] = None,
+        kind: str = "calibration",
+        update: bool = True,
+    ) -> None:
+        """Add a result to the history and, if ``update``, make it the waypoint."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO history (tag_id, x, y, z, iterations, duration, kind, created)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (int(tag_id), float(x), float(y), z, iterations, duration, kind, now),
+                )
+                if update:
+                    self._conn.execute(
+                        "INSERT INTO waypoints (tag_id, x, y, z, updated) VALUES (?, ?, ?, ?, ?)"
+                        " ON CONFLICT(tag_id) DO UPDATE SET"
+                        " x = excluded.x, y = excluded.y, z = excluded.z, updated = excluded.updated",
+                        (int(tag_id), float(x), float(y), z, now),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def history(self, tag_id: int, limit: Optional[int] = None) -> List[HistoryEntry]:
+        """Results for ``tag_id``, newest first."""
+        query = (
+            "SELECT tag_id, x, y, z, iterations, duration, kind, created FROM history"
+            " WHERE tag_id = ? ORDER BY created DESC, id DESC"
+        )
+        params = [int(tag_id)]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [HistoryEntry(*row) for row in rows]
+
+    def estimate(self, tag_id: int) -> Optional[Estimate]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tag_id, x, y, weight, updated FROM estimates WHERE tag_id = ?",
+                (int(tag_id),),
+            ).fetchone()
+        return None if row is None else Estimate(*row)
+
+    def add_sightings(self, sightings: Iterable[Tuple[int, float, float, float]]) -> None:
+        """Fold (tag_id, x, y, weight) sightings into the estimates at once."""
+        sightings = list(sightings)
+        if not sightings:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for tag_id, x, y, weight in sightings:
+                    row = self._conn.execute(
+                        "SELECT x, y, weight FROM estimates WHERE tag_id = ?",
+                        (int(tag_id),),
+                    ).fetchone()
+                    if row is not None:
+                        old_x, old_y, old_weight = row
+                        total = old_weight + weight
+                        x = (old_x * old_weight + x * weight) / total
+                        y = (old_y * old_weight + y * weight) / total
+                        weight = min(total, self.max_estimate_weight)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO estimates (tag_id, x, y, weight, updated)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        (int(tag_id), float(x), float(y), float(weight), now),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def import_legacy(self, legacy_path: Union[str, Path]) -> None:
+        legacy_path = Path(legacy_path)
+        if not legacy_path.exists():
+            return
+        if legacy_path.suffix == ".json":
+            with open(legacy_path, "r") as f:
+                data = json.load(f)
+            markers = [(name, coords["x"], coords["y"]) for name, coords in data.items()]
+        else:
+            markers = []
+            with open(legacy_path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        markers.append(tuple(line.split(",")[:3]))
+        for name, x, y in markers:
+            self.record(int(name), float(x), float(y), kind="import")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    print("This module is intended to be imported, not run directly.")
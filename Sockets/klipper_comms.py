@@ -4,19 +4,26 @@ import os
 import fcntl
 import errno
 import threading
-import time
 
 
 class KlipperComms:
-    def __init__(self):
-        self.command_socket_path = "/tmp/command_socket.sock"
-        self.control_socket_path = "/tmp/control_socket.sock"
+    def __init__(self, command_socket_path="/tmp/command_socket.sock", control_socket_path="/tmp/control_socket.sock"):
+        # Each printer needs its own pair of paths when several share a host
+        self.command_socket_path = command_socket_path
+        self.control_socket_path = control_socket_path
+        os.makedirs(os.path.dirname(self.control_socket_path), exist_ok=True)
         self.command_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) # self.bind_sockets(self.command_socket_path)
         self.control_socket = self.bind_sockets(self.control_socket_path)
         self.tag_id = None
+        # "calibrate" for APRILTAGS, "verify" for APRILTAGS_VERIFY
+        self.mode = "calibrate"
+        self.position = None
         self.needCommand = False
+        # Set alongside needCommand so waiters wake on the REQUEST instead of polling
+        self.requested = threading.Event()
+        self.started = threading.Event()
         self.startCommand = False
-        self.thread = threading.Thread(target=self.start_control_socket)
+        self.thread = threading.Thread(target=self.start_control_socket, daemon=True)
         self.thread.start()
 
     def bind_sockets(self, path):
@@ -39,38 +46,71 @@ class KlipperComms:
             print("Waiting for control socket connection")
             conn, addr = self.control_socket.accept()
             data = conn.recv(1024).decode()
-            if data.startswith("START") and not self.startCommand:
+            if data.startswith(("START", "VERIFY")) and not self.startCommand:
+                self.mode = "verify" if data.startswith("VERIFY") else "calibrate"
                 self.tag_id = int(data.split(" ")[1])
+                self.update_position(data)
                 self.needCommand = True
                 self.startCommand = True
+                self.requested.set()
+                self.started.set()
             elif data.startswith("REQUEST") and self.startCommand:
+                self.update_position(data)
                 self.needCommand = True
+                self.requested.set()
             conn.close()
                 
     def sendCommand(self, command):
-        while not self.needCommand:
-            time.sleep(0.1)
+        self.requested.wait()
         if command == "DONE":
             self.startCommand = False
             self.endRunning()
+        # Cleared before sending, a fast REQUEST for the next one must not be lost
+        self.needCommand = False
+        self.requested.clear()
         self.command_socket.sendto(command.encode(),self.command_socket_path)
         print(f"Sent command: {command}")
-        self.needCommand = False
                 
+    def update_position(self, data):
+        # Messages look like "REQUEST <tag_id> <x> <y> <z>", the coordinates are
+        # the toolhead's commanded position when the message was sent
+        parts = data.split()
+        if len(parts) < 5:
+            return
+        try:
+            self.position = tuple(float(value) for value in parts[2:5])
+        except ValueError:
+            print(f"Invalid position in message: {data}")
+
+    def get_position(self):
+        return self.position
+
     def currentlyRunning(self):
         return self.tag_id is not None
     
     def get_tag_id(self):
         return self.tag_id
+
+    def get_mode(self):
+        return self.mode
     
     def endRunning(self):
         self.tag_id = None
+        self.started.clear()
     
     def get_needCommand(self):
         return self.needCommand
     
     def requestCommand(self):
         self.needCommand = False
+        self.requested.clear()
+
+    def wait_for_request(self, timeout=None):
+        # True once the extension has asked for the next command
+        return self.requested.wait(timeout)
+
+    def wait_for_start(self, timeout=None):
+        return self.started.wait(timeout)
 
     # def start_command_socket(self):
     #     # For SOCK_DGRAM, we don't use listen/accept
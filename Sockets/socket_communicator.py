@@ -2,9 +2,9 @@ import socket
 import time
 
 class PrinterConnection:
-    def __init__(self):
-        self.camera_loop_path = "/tmp/camera_loop.sock"
-        self.camera_ctrl_path = "/tmp/camera_ctrl.sock"
+    def __init__(self, camera_loop_path="/tmp/camera_loop.sock", camera_ctrl_path="/tmp/camera_ctrl.sock"):
+        self.camera_loop_path = camera_loop_path
+        self.camera_ctrl_path = camera_ctrl_path
         self.camera_loop = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
         self.camera_loop.connect(self.camera_loop_path)
         self.tag_id = None
@@ -8,18 +8,24 @@ class workcell_controller:
     def __init__(self, config):
         self.printer = config.get_printer()
         self.gcode = self.printer.lookup_object('gcode')
-        self.command_socket_path = "/tmp/command_socket.sock"
-        self.control_socket_path = "/tmp/control_socket.sock"
+        # Give every printer on a shared host its own pair, e.g.
+        # command_socket: /tmp/workcell/printer2/command_socket.sock
+        self.command_socket_path = config.get('command_socket', "/tmp/command_socket.sock")
+        self.control_socket_path = config.get('control_socket', "/tmp/control_socket.sock")
         self.command_socket = None
         self.control_socket = None
         self.reactor = self.printer.get_reactor()
         self.timer = None
+        # Set once a command has run, the REQUEST for the next one waits until
+        # its moves have finished so the position it carries is current
+        self.request_when_idle = False
         
         # self.printer.register_event_handler('klippy:ready', self._start)
         self.printer.register_event_handler('klippy:shutdown', self._shutdown)
         self.printer.register_event_handler('klippy:disconnect', self._shutdown)
         
         self.gcode.register_command('APRILTAGS', self._cmd_APRILTAGS)
+        self.gcode.register_command('APRILTAGS_VERIFY', self._cmd_APRILTAGS_VERIFY)
         # self.gcode.register_command('STOP_COMMS', self._cmd_STOP_COMMS)
         
     # def _start(self):
@@ -46,9 +52,34 @@ class workcell_controller:
             return False
         else:
             return True
+
+    def _next_tick(self, eventtime):
+        # Wake up when the queued moves should have finished (plus the 50 ms
+        # idle margin above) rather than polling every 100 ms
+        toolhead = self.printer.lookup_object('toolhead')
+        print_time, est_print_time, lookahead_empty = toolhead.check_busy(eventtime)
+        if not lookahead_empty:
+            return self.reactor.monotonic() + 0.05
+        remaining = print_time - est_print_time + 0.05
+        return self.reactor.monotonic() + min(max(remaining, 0.01), 0.5)
+            
+    def _toolhead_position(self):
+        # Commanded XYZ of the toolhead, sent with every message so the calibrator
+        # does not have to dead-reckon where the gantry is
+        toolhead = self.printer.lookup_object('toolhead')
+        x, y, z = toolhead.get_position()[:3]
+        return f"{x:.3f} {y:.3f} {z:.3f}"
             
     def _cmd_APRILTAGS(self, gcmd):
-        tag_id = gcmd.get_int('TAG_ID')
+        self._start_session(gcmd, "START")
+
+    def _cmd_APRILTAGS_VERIFY(self, gcmd):
+        # Check the stored waypoint at one height, the calibrator only runs a
+        # full calibration when the tag has drifted
+        self._start_session(gcmd, "VERIFY")
+
+    def _start_session(self, gcmd, kind):
+        tag_id = gcmd.get_int('TAG_ID', None)
         if tag_id is None:
             self.gcode.respond_info("[Workcell Controller] No tag ID provided")
             return
@@ -57,19 +88,27 @@ class workcell_controller:
             self.gcode.respond_info("[Workcell Controller] Socket already running")
             return
         self.command_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        os.makedirs(os.path.dirname(self.command_socket_path), exist_ok=True)
         if os.path.exists(self.command_socket_path):
             os.unlink(self.command_socket_path)
         self.command_socket.bind(self.command_socket_path)
+        # _tick runs in Klipper's reactor, an empty socket must not block it
+        self.command_socket.setblocking(False)
         self.control_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         try:
             self.control_socket.connect(self.control_socket_path)
-            self.control_socket.send(f"START {tag_id}".encode())
+            self.control_socket.send(f"{kind} {tag_id} {self._toolhead_position()}".encode())
             self.control_socket.close()
         except Exception as e:
             self.gcode.respond_info(f"[Workcell Controller] Error connecting to control socket, is auto calibrator running?")
+        # START/VERIFY already asks for the first command
+        self.request_when_idle = False
         self.timer = self.reactor.register_timer(self._tick, self.reactor.NEVER)
         self.reactor.update_timer(self.timer, self.reactor.monotonic() + 0.1)
-        self.gcode.respond_info(f"[Workcell Controller] Moving to tag {tag_id}")
+        if kind == "VERIFY":
+            self.gcode.respond_info(f"[Workcell Controller] Verifying tag {tag_id}")
+        else:
+            self.gcode.respond_info(f"[Workcell Controller] Moving to tag {tag_id}")
         
     def _drain_socket(self):
         try:
@@ -87,28 +126,34 @@ class workcell_controller:
         return None
         
     def _tick(self, eventtime):
-        if not self._toolhead_is_busy(eventtime):
+        if self._toolhead_is_busy(eventtime):
+            return self._next_tick(eventtime)
+        if self.request_when_idle:
             self.control_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             self.control_socket.connect(self.control_socket_path)
-            self.control_socket.send(f"REQUEST {self.tag_id}".encode())
+            self.control_socket.send(f"REQUEST {self.tag_id} {self._toolhead_position()}".encode())
             self.control_socket.close()
-            command = self._drain_socket()
-            if command is not None:
-                if command == "DONE":
-                    self.gcode.respond_info(f"[Workcell Controller] Detected tag {self.tag_id}")
-                    self.tag_id = None
-                    if self.control_socket:
-                        self.control_socket.close()
-                    self.reactor.unregister_timer(self.timer)
-                    self.timer = None
-                    return self.reactor.NEVER
-                if self._toolhead_is_busy(eventtime):
-                    return self.reactor.monotonic() + 0.1
-                else:
-                    self.gcode.run_script_from_command(command)
-                    return self.reactor.monotonic() + 0.1
-        else:
-            return self.reactor.monotonic() + 0.1
+            self.request_when_idle = False
+        command = self._drain_socket()
+        if command is None:
+            # Idle and waiting on the calibrator
+            return self.reactor.monotonic() + 0.05
+        if command == "DONE":
+            self.gcode.respond_info(f"[Workcell Controller] Detected tag {self.tag_id} at {self._toolhead_position()}")
+            self.tag_id = None
+            if self.control_socket:
+                self.control_socket.close()
+            self.reactor.unregister_timer(self.timer)
+            self.timer = None
+            return self.reactor.NEVER
+        if command.startswith("INFO "):
+            # Calibrator messages for the console, no [respond] section needed
+            self.gcode.respond_info(f"[Workcell Controller] {command[5:]}")
+            self.request_when_idle = True
+            return self.reactor.monotonic() + 0.01
+        self.gcode.run_script_from_command(command)
+        self.request_when_idle = True
+        return self._next_tick(self.reactor.monotonic())
                 
             
 def load_config(config):
@@ -1,74 +1,32 @@
-import websockets
 import json
 import asyncio
-import itertools
+import os
+import sys
 
-class CameraController:
+sys.path.append(os.path.join(os.path.dirname(__file__), "AprilTags"))
+from moonrakerClient import MoonrakerClient
+
+class CameraController(MoonrakerClient):
     def __init__(self):
-        self.websocket = None
-        self.uri = "ws://192.168.0.100:7125/websocket"
-        self.running = False
-        self._id_iter = itertools.count(1)
+        super().__init__("ws://192.168.0.100:7125/websocket")
+
+    def _on_gcode_response(self, params):
+        if params:
+            print(f"Klipper: {params[0]}")
 
     async def connect(self):
         """Connect to Moonraker WebSocket and keep connection open"""
-        try:
-            self.websocket = await websockets.connect(self.uri)
-            self._id_iter = itertools.count(1)
-            print("Connected to Moonraker websocket - connection will stay open")
-            self.running = True
-            return True
-        except Exception as e:
-            print(f"Failed to connect: {e}")
-            return False
-
-    async def disconnect(self):
-        """Close the WebSocket connection"""
-        if self.websocket:
-            await self.websocket.close()
-            print("Connection closed")
-            self.running = False
-
-    async def _await_response(self, request_id):
-        """Wait for the Moonraker response that matches the request id"""
-        while True:
-            raw_message = await self.websocket.recv()
-            try:
-                message = json.loads(raw_message)
-            except json.JSONDecodeError:
-                print(f"Received non-JSON message: {raw_message}")
-                continue
-
-            if message.get("id") == request_id:
-                if "error" in message:
-                    raise RuntimeError(message["error"])
-                return message
-
-            method = message.get("method")
-            if method == "notify_gcode_response":
-                params = message.get("params") or []
-                if params:
-                    print(f"Klipper: {params[0]}")
-                continue
-
-            print(f"Ignoring unsolicited message: {message}")
+        self.unsubscribe("notify_gcode_response", self._on_gcode_response)
+        self.subscribe("notify_gcode_response", self._on_gcode_response)
+        return await super().connect()
 
     async def _send_gcode(self, script, description=None):
-        if not self.websocket or not self.running:
+        if self.websocket is None:
             print("WebSocket not connected")
             return None
 
-        request_id = next(self._id_iter)
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "printer.gcode.script",
-            "params": {"script": script},
-            "id": request_id,
-        }
-
         try:
-            await self.websocket.send(json.dumps(payload))
-            response = await self._await_response(request_id)
+            response = await self.call("printer.gcode.script", {"script": script})
             response_text = json.dumps(response, separators=(",", ":"))
             if description:
                 print(f"{description} - Response: {response_text}")